@@ -0,0 +1,3 @@
+from simasm.driver import main
+
+main()
@@ -0,0 +1,94 @@
+'''Functional execution of one instruction stream over a batch of memory images.
+
+Each FP register lane holds a vector over the batch, and memory is a
+(batch x memsize) NumPy array, so every instruction runs once for the
+whole batch.  Integer registers, and therefore addresses, are shared.'''
+import numpy as np
+from simasm import isa
+from simasm.ppc import FPVal, FPRegister, IntRegister
+from simasm.simulate import Core
+
+class VectorRegisterFile:
+    '''FP registers holding a vector of primary and secondary lanes.  Reads
+    return views, which is safe because instructions read all their
+    operands before writing the target.'''
+    def __init__(self,cons,numregisters,batch):
+        self.names = [cons(i) for i in range(numregisters)]
+        self.lanes = np.zeros((numregisters,2,batch))
+    def __str__(self):
+        return 'VectorRegisterFile(%s)' % ', '.join('%s=%s' % (name,self[name]) for name in self.names)
+    def __repr__(self):
+        return 'VectorRegisterFile(%r)' % (self.lanes,)
+    def __getitem__(self,reg):
+        lanes = self.lanes[reg.num]
+        return FPVal(lanes[0],lanes[1])
+    def __setitem__(self,reg,rval):
+        self.lanes[reg.num,0] = rval.p
+        self.lanes[reg.num,1] = rval.s
+    def keys(self):
+        return iter(self.names)
+    def get(self,*regs):
+        return map(self.__getitem__,regs)
+
+class BatchCore(Core):
+    '''Core running over mem, a (batch x memsize) array of memory images.
+    The images are updated in place when mem is a float64 array.'''
+    def __init__(self,mem,**kwargs):
+        images = np.asarray(mem,dtype=float)
+        if images.ndim != 2:
+            raise Exception('Batch memory must be (batch x memsize), got shape %r' % (images.shape,))
+        self.images = images
+        Core.__init__(self,fp=VectorRegisterFile(FPRegister,self.fpregisters,len(images)),
+                      mem=images.T,**kwargs) # mem[ea] is the batch of doubles at ea
+    @property
+    def batch(self):
+        return len(self.images)
+    def lanes(self,reg):
+        'The (batch x 2) contents of a register'
+        return self.fp.lanes[self.get_fpregister(reg,allocate=False).num].T
+
+def run_scalar(code,images,setup=None,**kwargs):
+    '''Reference: run code separately on each image, returning the final
+    memory images and the (batch x numregisters x 2) register contents'''
+    mems, regs = [], []
+    for image in images:
+        c = Core(mem=[float(x) for x in image],**kwargs)
+        if setup: setup(c)
+        c.execute(code)
+        mems.append(c.mem)
+        regs.append([c.fp[name] for name in c.fp.keys()])
+    return np.array(mems), np.array(regs)
+
+def test():
+    rng = np.random.default_rng(0)
+    images = rng.standard_normal((64,32))
+    (i0,i1,i2,sixteen) = map(IntRegister,range(4))
+    def setup(c):
+        c.execute([isa.intset(i0,0), isa.intset(i1,64), isa.intset(i2,128), isa.intset(sixteen,16)])
+    (w,a,b,r,s,t) = map(FPRegister,range(6))
+    code = [isa.fpset2(w,1/9,2/9),
+            isa.lfpd(a,i0,0),
+            isa.lfpdx(b,i1,sixteen),
+            isa.lfdu(r,i0,24),
+            isa.lfsdux(r,i1,sixteen),
+            isa.fxcpmadd(r,w,a,r),
+            isa.fxcxma(s,w,b,r),
+            isa.fxmul(t,a,b),
+            isa.fxpmul(a,t,s),
+            isa.fadd(b,a,s),
+            isa.fmr(t,b),
+            isa.lfd(s,i2,8),
+            isa.stfxdux(r,i2,sixteen),
+            isa.stfpdux(t,i2,sixteen),
+            isa.stfxdux(s,i1,sixteen),
+            ]
+    mems, regs = run_scalar(code,images,setup)
+    c = BatchCore(images.copy())
+    setup(c)
+    c.execute(code)
+    assert np.array_equal(c.images.view(np.uint64),mems.view(np.uint64))
+    assert np.array_equal(c.fp.lanes.transpose(2,0,1).view(np.uint64),regs.view(np.uint64))
+    print('BatchCore matches %d scalar runs bit-for-bit (%d cycles)' % (c.batch,c.cycle))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,3 @@
+from simasm.benchmarks.suite import main
+
+main()
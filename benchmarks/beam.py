@@ -0,0 +1,87 @@
+'''Cycles saved by schedule.beam_schedule over the list schedules
+
+    python -m simasm.benchmarks.beam [width ...]
+
+The incumbent is the better of the greedy (Core.schedule) and the
+critical-path list schedules, which beam_schedule starts from.  On the
+test kernels and the stencil the beam only matches it, so the gain over
+greedy there is the critical-path heuristic's.  The beam itself saves a
+cycle on a few of the random kernels, whose reused names tangle the
+dependences, and more of them the wider it is.
+'''
+import itertools
+import random
+import sys
+from simasm import isa
+from simasm.ppc import IntRegister
+from simasm.schedule import DependenceGraph, beam_schedule, list_schedule
+from simasm.simulate import VirtualCore, get_core, stencil, stencil_body, test_kernels
+
+def random_kernel(seed,n=24,names=10):
+    'n FP instructions over a few reused names, loads through three pointers'
+    rng = random.Random(seed)
+    regs = ['x%d' % i for i in range(names)]
+    r = lambda: rng.choice(regs)
+    code = []
+    for k in range(n):
+        kind = rng.randrange(5)
+        if kind == 0:
+            code.append(isa.fxcpmadd(r(),r(),r(),r()))
+        elif kind == 1:
+            code.append(isa.fxmul(r(),r(),r()))
+        elif kind == 2:
+            code.append(isa.lfpd(r(),IntRegister(rng.randrange(3)),0))
+        elif kind == 3:
+            code.append(isa.fadd(r(),r(),r()))
+        else:
+            code.append(isa.fmr(r(),r()))
+    return code
+
+def kernels(count=20):
+    for kernel in test_kernels:
+        def setup(kernel=kernel):
+            c = get_core(timing_only=True)
+            return c, kernel(c)
+        yield kernel.__name__, setup
+    def setup():
+        c = VirtualCore(timing_only=True)
+        c.execute(list(itertools.islice(stencil(),2))) # Weights
+        return c, list(stencil_body())
+    yield 'stencil_body', setup
+    for seed in range(count):
+        yield 'random %d' % seed, lambda seed=seed: (VirtualCore(timing_only=True),random_kernel(seed))
+
+def incumbent(setup):
+    'Cycles of the greedy and the critical-path list schedules'
+    cycles = []
+    for variant in ('stream','critical-path'):
+        c, istream = setup()
+        dag = DependenceGraph(istream)
+        start = c.cycle
+        list_schedule(c,istream,[0]*len(istream) if variant == 'stream' else [-h for h in dag.heights()],dag)
+        cycles.append(c.cycle - start)
+    return cycles
+
+def main(*widths):
+    widths = widths or (1,4,16)
+    print('%-14s %5s %7s %9s' % ('kernel','instr','greedy','incumbent')
+          + ''.join(' %9s' % ('beam %d' % w) for w in widths))
+    total = [0]*(1 + len(widths))
+    for (name,setup) in kernels():
+        c, istream = setup()
+        greedy, critical = incumbent(setup)
+        best = min(greedy,critical)
+        line = '%-14s %5d %7d %9d' % (name,len(istream),greedy,best)
+        total[0] += best
+        for (k,width) in enumerate(widths):
+            c, istream = setup()
+            start = c.cycle
+            beam_schedule(c,istream,width)
+            line += ' %4d(%+d)' % (c.cycle - start,c.cycle - start - best)
+            total[k + 1] += c.cycle - start
+        print(line)
+    print('%-14s %5s %7s %9d' % ('total','','',total[0])
+          + ''.join(' %4d(%+d)' % (cycles,cycles - total[0]) for cycles in total[1:]))
+
+if __name__ == '__main__':
+    main(*map(int,sys.argv[1:]))
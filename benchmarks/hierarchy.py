@@ -0,0 +1,43 @@
+'''Throughput of the memory hierarchy model, alone and under Core.execute
+
+    python -m simasm.benchmarks.hierarchy [accesses]
+
+Hierarchy.loads is timed on address streams of the given length with
+sequential, strided and random patterns; then the stencil is executed
+with and without a Hierarchy to show what the model costs per
+instruction.'''
+import itertools
+import sys
+import time
+import numpy as np
+from simasm import isa
+from simasm.hierarchy import Hierarchy
+from simasm.simulate import VirtualCore, stencil
+
+def patterns(n):
+    yield 'sequential', np.arange(n)*16
+    yield 'stride 4 KB', (np.arange(n)*4096) % (1 << 30)
+    yield 'random 1 GB', np.random.RandomState(0).randint(0,1 << 27,n)*8
+
+def main(n=10**6):
+    print('%-14s %12s %10s' % ('pattern','accesses/s','seconds'))
+    for (label,addrs) in patterns(n):
+        h = Hierarchy()
+        start = time.perf_counter()
+        h.loads(addrs)
+        elapsed = time.perf_counter() - start
+        print('%-14s %12.0f %10.2f' % (label,n/elapsed,elapsed))
+    iterations = 200
+    row = 4096
+    code = ([isa.intset('p_%d_%d' % (i,j),8*row*(3*i + j)) for i in range(3) for j in range(3)]
+            + list(itertools.islice(stencil(),2 + 144*iterations)))
+    for hierarchy in (None,Hierarchy()):
+        c = VirtualCore(mem=np.zeros(9*row + 12*iterations),hierarchy=hierarchy)
+        start = time.perf_counter()
+        c.execute(code)
+        elapsed = time.perf_counter() - start
+        print('stencil %-15s %8.0f instructions/s, %d cycles'
+              % ('with hierarchy' if hierarchy else 'fixed latency',len(code)/elapsed,c.cycle))
+
+if __name__ == '__main__':
+    main(*map(int,sys.argv[1:]))
@@ -0,0 +1,73 @@
+'''Memory used per instruction object and per register file, against the
+baseline layout (instructions with a __dict__ of sets, an OrderedDict of
+operands and a dict of in-use registers; a register file of TrueRegister
+objects), rebuilt here so that the reduction can be reproduced
+
+    python -m simasm.benchmarks.memory [count]
+'''
+import itertools
+import sys
+import tracemalloc
+from collections import OrderedDict as odict
+from simasm.ppc import RegisterFile, FPRegister, IntRegister, TrueRegister
+from simasm.simulate import stencil
+
+def measure(build):
+    'Bytes held by what build returns, once the first call has warmed up any caches'
+    build()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    obj = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, obj
+
+def instructions(count):
+    return itertools.islice(itertools.chain.from_iterable(
+        itertools.islice(stencil(),72) for _ in itertools.count()),count)
+
+class BaselineInstruction:
+    'The attributes of instr, set in the order the baseline Instruction set them'
+    def __init__(self,instr):
+        self.read = set(instr.read)
+        self.write = set(instr.write)
+        self.iread = set(instr.iread)
+        self.iwrite = set(instr.iwrite)
+        # save split a string of the operand names, so each instruction held its own keys
+        self.saved = odict((sym,getattr(instr,sym)) for sym in ' '.join(instr.operands).split())
+        self.unit = instr.unit
+        self.latency = instr.latency
+        self.ithroughput = instr.ithroughput
+        self.writethrough = instr.writethrough
+        self.inuse_regs = dict(instr.inuse_regs)
+        self.pragmatic = instr.pragmatic
+        for (sym,val) in self.saved.items():
+            setattr(self,sym,val)
+
+baseline_classes = {}
+def baseline(instr):
+    'One class per opcode, as in the baseline, so instances of each share their dict keys'
+    cls = type(instr)
+    if cls not in baseline_classes:
+        baseline_classes[cls] = type(cls.__name__,(BaselineInstruction,),{})
+    return baseline_classes[cls](instr)
+
+class BaselineRegisterFile:
+    def __init__(self,cons,numregisters):
+        self.bank = [TrueRegister(cons(i),cons(i).empty()) for i in range(numregisters)]
+
+def main(count=100000):
+    nbytes, stream = measure(lambda: list(instructions(count)))
+    del stream
+    old, stream = measure(lambda: [baseline(instr) for instr in instructions(count)])
+    del stream
+    print('%-28s %8.1f bytes/instruction, baseline %.1f (%.1fx)'
+          % ('stencil() stream',nbytes/count,old/count,old/nbytes))
+    for cons in (FPRegister,IntRegister):
+        nbytes, regs = measure(lambda: RegisterFile(cons,32))
+        old, regs = measure(lambda: BaselineRegisterFile(cons,32))
+        print('%-28s %8d bytes, baseline %d (%.1fx)'
+              % ('RegisterFile(%s,32)' % cons.__name__,nbytes,old,old/nbytes))
+
+if __name__ == '__main__':
+    main(*map(int,sys.argv[1:]))
@@ -0,0 +1,144 @@
+'''Throughput of Core.execute, Core.schedule and CViewer emission
+
+    python -m simasm.benchmarks run [-o results.json] [--max-size N]
+    python -m simasm.benchmarks compare old.json new.json [--threshold 0.1]
+
+Kernels are prefixes of stencil() of 10**2 up to 10**5 instructions and
+the tests() streams.  Each operation is timed separately (best of a few
+runs for the small kernels) and reported as instructions per second, with
+the peak RSS of the process so far.  The scaling exponent is the slope of
+log(time) against log(size) over the stencil kernels, 1 being linear.'''
+import argparse
+import itertools
+import json
+import math
+import platform
+import resource
+import sys
+import time
+from simasm.simulate import VirtualCore, get_core, stencil, test_kernels
+
+SIZES = (10**2,10**3,10**4,10**5)
+GREEDY_LIMIT = 10**3            # Core.schedule without use_dag is quadratic
+
+def kernels(max_size):
+    '''Yield (name, size, setup), setup returning a fresh core and a list
+    of instructions for it'''
+    for n in SIZES:
+        if n <= max_size:
+            code = list(itertools.islice(stencil(),n))
+            # The pointers advance 6 doubles every 72 instructions
+            yield 'stencil', n, lambda n=n,code=code: (VirtualCore(mem=[0.0]*(n//12 + 32)),list(code))
+    for kernel in test_kernels:
+        # These allocate registers on the core they are built for
+        def setup(kernel=kernel):
+            c = get_core()
+            return c, kernel(c)
+        yield kernel.__name__, len(setup()[1]), setup
+
+def operations(n,setup):
+    '''Yield (name, prepare), prepare doing any untimed setup and returning
+    the function to time'''
+    def execute():
+        (c,istream) = setup()
+        return lambda: c.execute(istream)
+    def schedule():
+        (c,istream) = setup()
+        return lambda: c.schedule(istream,use_dag=True)
+    def schedule_greedy():
+        (c,istream) = setup()
+        return lambda: c.schedule(istream)
+    def emit():
+        (c,istream) = setup()
+        c.execute(istream)      # Allocates every register
+        real = [instr for instr in istream if not instr.pragmatic]
+        return lambda: [c.cv.named_view(instr) for instr in real]
+    yield 'execute', execute
+    yield 'schedule', schedule
+    if n <= GREEDY_LIMIT:
+        yield 'schedule_greedy', schedule_greedy
+    yield 'emit', emit
+
+def measure(prepare,n):
+    'Best time of a few runs, fewer for big kernels'
+    repeat = max(1,min(5,10**4 // n))
+    best = math.inf
+    for r in range(repeat):
+        run = prepare()
+        start = time.perf_counter()
+        run()
+        best = min(best,time.perf_counter() - start)
+    return best
+
+def peak_rss_kb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == 'darwin' else rss # Bytes on macOS, KiB elsewhere
+
+def scaling(results):
+    'Least-squares slope of log(seconds) against log(n) for each stencil operation'
+    exponents = dict()
+    for op in sorted(set(r['op'] for r in results)):
+        points = [(math.log(r['n']),math.log(r['seconds'])) for r in results
+                  if r['op'] == op and r['kernel'] == 'stencil' and r['seconds'] > 0]
+        if len(points) < 2:
+            continue
+        mx = sum(x for (x,y) in points)/len(points)
+        my = sum(y for (x,y) in points)/len(points)
+        exponents[op] = (sum((x-mx)*(y-my) for (x,y) in points)
+                         / sum((x-mx)**2 for (x,y) in points))
+    return exponents
+
+def run(max_size=SIZES[-1],output=None):
+    results = []
+    print('%-14s %7s %-16s %10s %12s %10s' % ('kernel','n','operation','seconds','instr/s','peak RSS'))
+    for (kernel,n,setup) in kernels(max_size):
+        for (op,prepare) in operations(n,setup):
+            seconds = measure(prepare,n)
+            r = dict(kernel=kernel,n=n,op=op,seconds=seconds,
+                     instr_per_sec=n/seconds if seconds > 0 else math.inf,peak_rss_kb=peak_rss_kb())
+            results.append(r)
+            print('%-14s %7d %-16s %10.4f %12.0f %8dkB' % (kernel,n,op,seconds,r['instr_per_sec'],r['peak_rss_kb']))
+    exponents = scaling(results)
+    for (op,exponent) in exponents.items():
+        print('scaling exponent %-16s %5.2f' % (op,exponent))
+    report = dict(python=platform.python_version(),machine=platform.machine(),
+                  time=time.strftime('%Y-%m-%dT%H:%M:%S'),results=results,scaling=exponents)
+    if output is not None:
+        with open(output,'w') as f:
+            json.dump(report,f,indent=1)
+    return report
+
+def compare(old,new,threshold=0.1):
+    '''Print the throughput change of each benchmark in both runs, flagging
+    slowdowns beyond threshold.  Returns the number flagged.'''
+    with open(old) as f:
+        before = dict(((r['kernel'],r['n'],r['op']),r) for r in json.load(f)['results'])
+    with open(new) as f:
+        after = json.load(f)['results']
+    slow = 0
+    for r in after:
+        key = (r['kernel'],r['n'],r['op'])
+        if key not in before:
+            continue
+        ratio = r['instr_per_sec']/before[key]['instr_per_sec']
+        flag = ratio < 1 - threshold
+        slow += flag
+        print('%-14s %7d %-16s %12.0f -> %12.0f  %+6.1f%%%s' % (key + (before[key]['instr_per_sec'],r['instr_per_sec'],
+                                                                  100*(ratio-1),'  SLOWER' if flag else '')))
+    return slow
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m simasm.benchmarks',description=__doc__.split('\n')[0])
+    commands = parser.add_subparsers(dest='command',required=True)
+    p = commands.add_parser('run',help='run the suite')
+    p.add_argument('-o','--output',help='write results to this JSON file')
+    p.add_argument('--max-size',type=int,default=SIZES[-1],help='largest stencil kernel')
+    p = commands.add_parser('compare',help='compare two JSON results')
+    p.add_argument('old')
+    p.add_argument('new')
+    p.add_argument('--threshold',type=float,default=0.1,help='fractional slowdown to flag')
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        run(args.max_size,args.output)
+    elif compare(args.old,args.new,args.threshold):
+        sys.exit(1)
@@ -0,0 +1,70 @@
+'''Full simulation versus Core(timing_only=True) on the stencil kernel, each
+executing the instruction list or a Program from Core.compile
+
+    python -m simasm.benchmarks.timing [repeat]
+
+The last two rows are the fast path without and with a TraceRecorder.
+Small kernels run on a fresh VirtualCore each time, so they are dominated
+by allocating the registers of their names.
+'''
+import itertools
+import sys
+import time
+from simasm.simulate import VirtualCore, stencil
+from simasm.trace import TraceRecorder
+
+def kernel():
+    return list(itertools.islice(stencil(),72))
+
+def run(repeat,compiled,**kwargs):
+    code = kernel()
+    # Each repetition advances the stencil pointers by 6 doubles
+    c = VirtualCore(mem=[0.0]*(6*repeat+16),**kwargs)
+    if compiled:
+        code = c.compile(code)
+    start = time.perf_counter()
+    for r in range(repeat):
+        c.execute(code)
+    if c.recorder is not None:
+        c.recorder.flush()      # Charge the last chunk too
+    return time.perf_counter() - start, c.cycle, dict(c.counter)
+
+def small(repeat,size=100,**kwargs):
+    'Best time to execute the first size instructions of the stencil on a fresh VirtualCore'
+    code = list(itertools.islice(stencil(),size))
+    best = None
+    for r in range(repeat):
+        c = VirtualCore(mem=[0.0]*2048,**kwargs)
+        start = time.perf_counter()
+        c.execute(code)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best,elapsed)
+    return best, len(c.regnames)
+
+def main(repeat=200):
+    code = kernel()
+    results = []
+    for (label,compiled,kwargs) in (('full',False,dict()),
+                                    ('full compiled',True,dict()),
+                                    ('timing_only',False,dict(timing_only=True)),
+                                    ('timing_only+scoreboard',False,dict(timing_only=True,use_scoreboard=True)),
+                                    ('timing_only+sb compiled',True,dict(timing_only=True,use_scoreboard=True)),
+                                    ('  with TraceRecorder',True,dict(timing_only=True,use_scoreboard=True,
+                                                                      recorder=TraceRecorder()))):
+        elapsed, cycles, counter = run(repeat,compiled,**kwargs)
+        results.append((label,elapsed,cycles,counter))
+    (_,base,cycles,counter) = results[0]
+    for (label,elapsed,c,cnt) in results:
+        if (c,cnt) != (cycles,counter):
+            raise Exception('%s disagrees with full simulation: %d cycles %r' % (label,c,cnt))
+        print('%-24s %8.0f instr/s  %5.2fx  (%d cycles)' % (label,repeat*len(code)/elapsed,base/elapsed,c))
+    (on,off) = (results[-1][1],results[-2][1])
+    print('TraceRecorder overhead    %+.0f%% time (%.0f vs %.0f instr/s)'
+          % (100*(on/off - 1),repeat*len(code)/on,repeat*len(code)/off))
+    for size in (100,1000):
+        for (label,kwargs) in (('full',dict()),('timing_only',dict(timing_only=True))):
+            elapsed, names = small(max(repeat//10,3),size,**kwargs)
+            print('%-24s %8.0f instr/s  (%d registers allocated)' % ('fresh %d %s' % (size,label),size/elapsed,names))
+
+if __name__ == '__main__':
+    main(*map(int,sys.argv[1:]))
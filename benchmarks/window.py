@@ -0,0 +1,31 @@
+'''Schedule quality, speed and memory of Core.schedule_stream by window size
+
+    python -m simasm.benchmarks.window [count [window ...]]
+'''
+import itertools
+import sys
+import time
+import tracemalloc
+from simasm.simulate import VirtualCore, stencil
+
+def run(count,window):
+    c = VirtualCore(timing_only=True) # The stream walks off the end of memory
+    tracemalloc.start()
+    start = time.perf_counter()
+    peaks = []
+    for (n,(instr,asm)) in enumerate(itertools.islice(c.schedule_stream(stencil(),window),count),1):
+        if n in (count//4,count):
+            peaks.append(tracemalloc.get_traced_memory()[1])
+    elapsed = time.perf_counter() - start
+    tracemalloc.stop()
+    return c.cycle, elapsed, peaks
+
+def main(count=20000,*windows):
+    windows = windows or (1,8,32,144)
+    print('%6s %8s %10s %9s %9s' % ('window','cycles','instr/s','peak@1/4','peak@end'))
+    for window in windows:
+        cycles, elapsed, (quarter,end) = run(count,window)
+        print('%6d %8d %10.0f %8dk %8dk' % (window,cycles,count/elapsed,quarter//1024,end//1024))
+
+if __name__ == '__main__':
+    main(*map(int,sys.argv[1:]))
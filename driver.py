@@ -0,0 +1,152 @@
+'''Schedule and simulate many kernels in one batch
+
+    python -m simasm KERNELS [-o OUTPUT] [-j JOBS] [--no-schedule] [--cache DIR]
+
+KERNELS is a stream saved by streamfile, a directory of them (*.sim), or
+a JSON manifest listing kernels, each either a stream or a setup function
+returning (core, code) as for node.Node:
+
+    [{"name": "stencil", "stream": "stencil.sim", "virtual": true},
+     {"name": "scale", "setup": "simasm.node:scale_partition", "args": [0, 1]}]
+
+Streams run on a Core (a VirtualCore with "virtual") with memsize doubles
+of zeroed memory.  The kernels are spread over a pool of worker processes
+that stay up for the whole batch.  For each kernel the output directory
+gets NAME.json (cycles, unit counters, instruction count) and NAME.s (the
+inline asm), and summary.json collects them all with the throughput in
+kernels per second.'''
+import argparse
+import importlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from simasm import streamfile
+from simasm.simulate import Core, VirtualCore
+
+MEMSIZE = 1 << 16               # Doubles of memory for streams
+
+def read_kernels(path,virtual=False,memsize=MEMSIZE):
+    'Kernel definitions (dicts) found at path, streams with absolute paths'
+    if os.path.isdir(path):
+        kernels = [dict(stream=os.path.join(path,name)) for name in sorted(os.listdir(path)) if name.endswith('.sim')]
+    elif path.endswith('.json'):
+        with open(path) as f:
+            kernels = json.load(f)
+        for kernel in kernels:
+            if 'stream' in kernel:
+                kernel['stream'] = os.path.join(os.path.dirname(os.path.abspath(path)),kernel['stream'])
+    else:
+        kernels = [dict(stream=path)]
+    names = set()
+    for kernel in kernels:
+        if 'stream' not in kernel and 'setup' not in kernel:
+            raise Exception('Kernel %r has neither a stream nor a setup' % (kernel,))
+        kernel.setdefault('name',os.path.splitext(os.path.basename(kernel.get('stream','')))[0] or kernel['setup'])
+        kernel.setdefault('virtual',virtual)
+        kernel.setdefault('memsize',memsize)
+        if kernel['name'] in names:
+            raise Exception('Two kernels named %r' % (kernel['name'],))
+        names.add(kernel['name'])
+    return kernels
+
+def setup_kernel(kernel):
+    'Fresh core and instructions of a kernel definition'
+    if 'stream' in kernel:
+        cls = VirtualCore if kernel['virtual'] else Core
+        return cls(mem=[0.0]*kernel['memsize']), streamfile.load(kernel['stream'])
+    (module,function) = kernel['setup'].split(':')
+    return getattr(importlib.import_module(module),function)(*kernel.get('args',()))
+
+def run_kernel(kernel,output,schedule=True,cache=None):
+    'Run one kernel in a worker, writing its outputs; returns its summary'
+    name = kernel['name']
+    result = dict(name=name,status='ok')
+    start = time.perf_counter()
+    try:
+        (c,code) = setup_kernel(kernel)
+        code = list(code)
+        cycle_start = c.cycle
+        if not schedule:
+            c.execute(code)
+        elif cache is not None:
+            from simasm.schedcache import ScheduleCache
+            result['cache'] = 'hit' if ScheduleCache(cache).schedule(c,code).hit else 'miss'
+        else:
+            c.schedule(code,use_dag=True) # Same order as the greedy Core.schedule
+        asm = c.inline_asm
+        with open(os.path.join(output,name + '.s'),'w') as f:
+            f.write(asm)
+        result.update(instructions=len(code),cycles=c.cycle - cycle_start,
+                      counter=dict((str(unit),n) for (unit,n) in c.counter.items()))
+    except Exception as e:
+        result.update(status='error',error='%s: %s' % (type(e).__name__,e))
+    result['seconds'] = time.perf_counter() - start
+    with open(os.path.join(output,name + '.json'),'w') as f:
+        json.dump(result,f,indent=1)
+    return result
+
+def run(kernels,output,jobs=None,schedule=True,cache=None):
+    'Run all kernels over jobs worker processes; returns the summary'
+    os.makedirs(output,exist_ok=True)
+    start = time.perf_counter()
+    results = []
+    with ProcessPoolExecutor(jobs) as pool:
+        futures = [pool.submit(run_kernel,kernel,output,schedule,cache) for kernel in kernels]
+        for future in as_completed(futures):
+            r = future.result()
+            print('%-24s %s' % (r['name'],'%d cycles, %d instructions' % (r['cycles'],r['instructions'])
+                                if r['status'] == 'ok' else r['error']))
+            results.append(r)
+    seconds = time.perf_counter() - start
+    order = dict((kernel['name'],i) for (i,kernel) in enumerate(kernels))
+    results.sort(key=lambda r: order[r['name']])
+    summary = dict(kernels=results,count=len(results),failed=sum(r['status'] != 'ok' for r in results),
+                   seconds=seconds,kernels_per_second=len(results)/seconds if seconds else 0.0,
+                   jobs=jobs or os.cpu_count(),schedule=schedule)
+    with open(os.path.join(output,'summary.json'),'w') as f:
+        json.dump(summary,f,indent=1)
+    print('%d kernels (%d failed) in %.2fs, %.1f kernels/s'
+          % (summary['count'],summary['failed'],seconds,summary['kernels_per_second']))
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m simasm',description=__doc__.split('\n')[0])
+    parser.add_argument('kernels',help='stream (.sim), directory of streams or JSON manifest')
+    parser.add_argument('-o','--output',default='simasm-out',help='directory for the per-kernel outputs and summary.json')
+    parser.add_argument('-j','--jobs',type=int,help='worker processes (default: all CPUs)')
+    parser.add_argument('--no-schedule',dest='schedule',action='store_false',help='execute in stream order')
+    parser.add_argument('--cache',help='schedcache directory to reuse schedules from')
+    parser.add_argument('--virtual',action='store_true',help='run streams on a VirtualCore (more FP registers)')
+    parser.add_argument('--memsize',type=int,default=MEMSIZE,help='doubles of memory for streams')
+    args = parser.parse_args(argv)
+    kernels = read_kernels(args.kernels,args.virtual,args.memsize)
+    summary = run(kernels,args.output,args.jobs,args.schedule,args.cache)
+    if summary['failed']:
+        sys.exit(1)
+
+def test(count=16):
+    import itertools
+    import tempfile
+    from simasm.simulate import stencil
+    from simasm.node import stencil_partition
+    with tempfile.TemporaryDirectory() as tmp:
+        setup = list(stencil_partition(0,1,iterations=1)[1])[:13]
+        for k in range(count):
+            streamfile.save(os.path.join(tmp,'stencil%02d.sim' % (k,)),
+                            setup + list(itertools.islice(stencil(),2,2 + 72*(k + 1))))
+        manifest = [dict(name='scale',setup='simasm.node:scale_partition',args=[0,1,256]),
+                    dict(name='broken',setup='simasm.node:no_such_setup'),
+                    dict(stream='stencil03.sim',virtual=True,memsize=4096)]
+        with open(os.path.join(tmp,'manifest.json'),'w') as f:
+            json.dump(manifest,f)
+        out = os.path.join(tmp,'out')
+        run(read_kernels(tmp,virtual=True),out,jobs=2)
+        run(read_kernels(os.path.join(tmp,'manifest.json')),out,jobs=2,cache=os.path.join(tmp,'cache'))
+        with open(os.path.join(out,'summary.json')) as f:
+            summary = json.load(f)
+        print(sorted(os.listdir(out))[:4],'...',[(r['name'],r['status']) for r in summary['kernels']])
+
+if __name__ == '__main__':
+    test()
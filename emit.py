@@ -0,0 +1,141 @@
+'''Destinations for the inline asm of the instructions a Core issues
+
+    c = Core(emitter=NullEmitter())               # No formatting at all
+    c = Core(emitter=ListEmitter(function='k'))   # c.inline_asm is a C function
+    with StreamEmitter('kernel.c') as e:          # Buffered writes to a file
+        Core(emitter=e).execute(code)
+'''
+import io
+import shutil
+import tempfile
+
+def c_header(c,name):
+    '''Opening of a C function taking the pointers c bound to symbolic integer
+    registers and any other integer registers its asm used'''
+    pointers = sorted(set((reg.num,reg.c_var) for reg in c.intnames.values() if reg.c_var) | c.cv.pointers)
+    return 'void %s(%s)\n{\n' % (name,', '.join('double *%s' % (var,) for (num,var) in pointers) or 'void')
+
+def c_function(c,name,body):
+    'Compilable C function around the asm body'
+    return c_header(c,name) + body + '}\n'
+
+class Emitter:
+    enabled = True              # Whether the core formats instructions at all
+    core = None                 # Set by Core.set_emitter
+    def __init__(self,function=None):
+        self.function = function # Name of the C function to wrap the asm in
+    def write(self,line):
+        raise Exception('Not implemented')
+    def getvalue(self):
+        raise Exception('Not implemented')
+    def close(self):
+        pass
+    def __enter__(self):
+        return self
+    def __exit__(self,*exc):
+        self.close()
+
+class NullEmitter(Emitter):
+    'Discards everything; the core does not even format the asm'
+    enabled = False
+    def write(self,line):
+        pass
+    def clear(self):
+        pass
+    def getvalue(self):
+        return ''
+
+class ListEmitter(Emitter):
+    'Keeps the lines in memory and joins them on demand'
+    def __init__(self,function=None):
+        Emitter.__init__(self,function)
+        self.lines = []
+    def write(self,line):
+        self.lines.append(line)
+    def clear(self):
+        del self.lines[:]
+    def getvalue(self):
+        body = ''.join(self.lines)
+        if self.function is not None:
+            return c_function(self.core,self.function,body)
+        return body
+
+class StreamEmitter(Emitter):
+    '''Writes to a path or text file, buffer lines at a time.  The C
+    function header depends on every pointer used, so with function the
+    body is spooled to a temporary file until close.'''
+    def __init__(self,target,function=None,buffer=256):
+        Emitter.__init__(self,function)
+        if isinstance(target,str):
+            self.target, self.owned = open(target,'w'), True
+        elif isinstance(target,io.TextIOBase):
+            self.target, self.owned = target, False
+        else:
+            raise Exception('Cannot stream inline asm to %r' % (target,))
+        self.out = tempfile.TemporaryFile('w+') if function is not None else self.target
+        self.buffer = buffer
+        self.pending = []
+    def write(self,line):
+        self.pending.append(line)
+        if len(self.pending) >= self.buffer:
+            self.flush()
+    def flush(self):
+        self.out.writelines(self.pending)
+        del self.pending[:]
+    def getvalue(self):
+        raise Exception('Inline asm was streamed to %r' % (self.target,))
+    def close(self):
+        if self.out is None:
+            return
+        self.flush()
+        if self.function is not None:
+            self.target.write(c_header(self.core,self.function))
+            self.out.seek(0)
+            shutil.copyfileobj(self.out,self.target)
+            self.target.write('}\n')
+            self.out.close()
+        self.target.flush()
+        if self.owned:
+            self.target.close()
+        self.out = None
+
+def test():
+    'ListEmitter and StreamEmitter give the text the core used to build by string concatenation'
+    import os
+    from simasm.simulate import get_core, test_kernels
+    def legacy(kernel):
+        c = get_core()
+        c.legacy_asm = ''
+        def print_inline(instr):
+            if not instr.pragmatic:
+                c.legacy_asm += '%s\n' % c.cv.named_view(instr)
+        c.print_inline = print_inline
+        c.schedule(kernel(c))
+        return c.legacy_asm
+    for kernel in test_kernels:
+        expected = legacy(kernel)
+        c = get_core(emitter=ListEmitter())
+        c.schedule(kernel(c))
+        if c.inline_asm != expected:
+            raise Exception('ListEmitter differs from the legacy inline_asm on %s' % kernel.__name__)
+        out = io.StringIO()
+        with StreamEmitter(out,buffer=4) as e:
+            c = get_core(emitter=e)
+            c.schedule(kernel(c))
+        if out.getvalue() != expected:
+            raise Exception('StreamEmitter differs from the legacy inline_asm on %s' % kernel.__name__)
+        c = get_core(emitter=ListEmitter(function='k'))
+        c.schedule(kernel(c))
+        function = c.inline_asm
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp,'k.c')
+            with StreamEmitter(path,function='k',buffer=4) as e:
+                c = get_core(emitter=e)
+                c.schedule(kernel(c))
+            with open(path) as f:
+                if f.read() != function:
+                    raise Exception('StreamEmitter function differs from ListEmitter on %s' % kernel.__name__)
+        print('%s: %d lines of asm agree, %d with the C function' % (kernel.__name__,expected.count('\n'),function.count('\n')))
+
+if __name__ == '__main__':
+    test()
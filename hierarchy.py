@@ -0,0 +1,113 @@
+'''Memory hierarchy deciding the latency of each load from its address
+
+    c = Core(mem=mem,hierarchy=Hierarchy())
+    c.execute(code)
+    print(c.hierarchy.counters)
+
+The defaults follow the PPC450: a 32 KB 64-way L1 with 32 byte lines,
+write-through without allocating on store misses, and an L2 that
+prefetches sequential streams of 128 byte lines.  Loads that hit in L1
+keep isa.load_latency; stores only update the counters, their cost being
+the WriteThrough tokens.  Addresses only exist when instructions run, so
+the hierarchy needs a Core that is not timing_only.  The model is plain
+Python, some 350-600 thousand accesses per second, so a million accesses
+take seconds; that is still small next to executing the instructions that
+make them (see benchmarks/hierarchy.py).'''
+from collections import Counter, OrderedDict
+from simasm import isa
+
+class Cache:
+    'Set-associative with LRU replacement, indexed by line'
+    def __init__(self,size=32*1024,line=32,ways=64):
+        if size % (line*ways):
+            raise Exception('Cache size %d is not a multiple of line*ways=%d' % (size,line*ways))
+        self.line = line
+        self.ways = ways
+        self.sets = [OrderedDict() for i in range(size // (line*ways))]
+    def access(self,addr,allocate=True):
+        'True on a hit; a miss brings the line in, evicting the least recently used'
+        line = addr // self.line
+        lines = self.sets[line % len(self.sets)]
+        if line in lines:
+            lines.move_to_end(line)
+            return True
+        if allocate:
+            if len(lines) >= self.ways:
+                lines.popitem(last=False)
+            lines[line] = None
+        return False
+
+class PrefetchStreams:
+    '''Up to streams sequential streams, each holding the lines from the last
+    one accessed to depth lines ahead.  A miss starts a new stream, replacing
+    the least recently used one.'''
+    def __init__(self,streams=7,line=128,depth=2):
+        self.nstreams = streams
+        self.line = line
+        self.depth = depth
+        self.streams = []       # [first, end) lines of each stream, most recently used last
+    def access(self,addr):
+        line = addr // self.line
+        streams = self.streams
+        for (i,(first,end)) in enumerate(streams):
+            if first <= line < end:
+                del streams[i]
+                streams.append((line,line + self.depth + 1))
+                return True
+        if len(streams) >= self.nstreams:
+            del streams[0]
+        streams.append((line,line + self.depth + 1))
+        return False
+
+class Hierarchy:
+    def __init__(self,l1=None,l2=None,l1_latency=isa.load_latency,l2_latency=12,memory_latency=104):
+        self.l1 = l1 if l1 is not None else Cache()
+        self.l2 = l2 if l2 is not None else PrefetchStreams()
+        self.l1_latency = l1_latency
+        self.l2_latency = l2_latency
+        self.memory_latency = memory_latency
+        self.counters = Counter()
+    def load(self,addr):
+        'Latency of a load from byte address addr'
+        if self.l1.access(addr):
+            self.counters['L1 load hit'] += 1
+            return self.l1_latency
+        self.counters['L1 load miss'] += 1
+        if self.l2.access(addr):
+            self.counters['L2 hit'] += 1
+            return self.l2_latency
+        self.counters['L2 miss'] += 1
+        return self.memory_latency
+    def store(self,addr):
+        self.counters['L1 store hit' if self.l1.access(addr,allocate=False) else 'L1 store miss'] += 1
+    def loads(self,addrs):
+        'Latencies of a stream of load addresses, e.g. a NumPy array'
+        load = self.load
+        return [load(addr) for addr in addrs.tolist()] if hasattr(addrs,'tolist') else list(map(load,addrs))
+
+def test(n=10**6):
+    import itertools
+    import time
+    import numpy as np
+    from simasm.simulate import VirtualCore, stencil
+    for (label,addrs) in (('sequential',np.arange(n)*16),
+                          ('stride 4 KB',(np.arange(n)*4096) % (1 << 30)),
+                          ('random',np.random.RandomState(0).randint(0,1 << 27,n)*8)):
+        h = Hierarchy()
+        start = time.perf_counter()
+        latencies = h.loads(addrs)
+        elapsed = time.perf_counter() - start
+        print('%-12s %7.0f accesses/s, mean latency %6.1f, %s'
+              % (label,n/elapsed,sum(latencies)/n,dict(h.counters)))
+    # The nine streams 32 KB apart, more than there are prefetch streams
+    row = 4096
+    code = ([isa.intset('p_%d_%d' % (i,j),8*row*(3*i + j)) for i in range(3) for j in range(3)]
+            + list(itertools.islice(stencil(),2 + 144*40)))
+    for hierarchy in (None,Hierarchy()):
+        c = VirtualCore(mem=np.zeros(9*row + 12*40),hierarchy=hierarchy)
+        c.execute(code)
+        print('stencil %s: %d cycles %s' % ('with hierarchy' if hierarchy else 'fixed latency',c.cycle,
+                                             dict(hierarchy.counters) if hierarchy else ''))
+
+if __name__ == '__main__':
+    test()
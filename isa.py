@@ -11,30 +11,45 @@ fpreg_load_source_latency = 5 # Number of cycles the register is unavailable to
 fpreg_load_dest_latency = 5 # Number of cycles the register is unavailable to be the destination of a FP operation
 
 class Instruction:
+    '''Operand metadata is kept in tuples and slots to keep long streams
+    compact.  Subclasses declare their operands in __slots__, in the order
+    they are saved, which also become their operands; a subclass of an
+    instruction may inherit them.'''
+    __slots__ = ('read','write','iread','iwrite','inuse_regs',
+                 'unit','latency','ithroughput','writethrough','pragmatic')
+    operands = None             # Names of the operand slots, set for each subclass
+    flops = 0                   # Floating point operations, over both lanes
+    merges = False              # Writes one lane of the target, keeping the other
+    kind = None                 # Which timing constants apply: 'fp', 'load' or 'store' (see simasm.sweep)
+    def __init_subclass__(cls,**kwargs):
+        super().__init_subclass__(**kwargs)
+        if '__slots__' in cls.__dict__:
+            cls.operands = tuple(cls.__slots__)
+        elif cls.operands is None:
+            raise Exception('Instruction %s must declare its operands in __slots__' % (cls.__name__,))
     def __init__(self, pragmatic=False):
-        self.read = set()
-        self.write = set()
-        self.iread = set()
-        self.iwrite = set()
-        self.saved = odict()
+        self.read = ()
+        self.write = ()
+        self.iread = ()
+        self.iwrite = ()
         self.uses(None,0)
-        self.inuse_regs = dict()
+        self.inuse_regs = ()
         self.pragmatic = pragmatic
     def run(self,c):
         raise Exception('Not implemented')
     def writes(self,*args):
-        self.write = set(args)
+        self.write = tuple(dict.fromkeys(args))
     def reads(self,*args):
-        self.read = set(args)
+        self.read = tuple(dict.fromkeys(args))
     def iwrites(self,*args):
-        self.iwrite = set(args)
+        self.iwrite = tuple(dict.fromkeys(args))
     def ireads(self,*args):
-        self.iread = set(args)
+        self.iread = tuple(dict.fromkeys(args))
     def inuse(self,register,src_latency,dst_latency):
         """The register is unavailable as a sourc/dest for other
         operations, but it's not a read/write hazard and the execution
         unit can be used for other purposes."""
-        self.inuse_regs[register] = (src_latency,dst_latency)
+        self.inuse_regs += ((register,(src_latency,dst_latency)),)
     def uses(self,unit,latency,ithroughput=1,writethrough=0):
         self.unit = unit
         self.latency = latency
@@ -44,13 +59,16 @@ class Instruction:
         if isinstance(symbols,str):
             symbols = symbols.split()
         for sym in symbols:
-            self.saved[sym] = loc[sym]
             setattr(self,sym,loc[sym])
+    @property
+    def saved(self):
+        return odict((sym,getattr(self,sym)) for sym in self.operands)
     def __repr__(self):
         return '%s(%s)' % (self.__class__.__name__,
                            ', '.join([('%s=%r' % (k,v)) for (k,v) in self.saved.items()]))
 
 class nop(Instruction):
+    __slots__ = ()
     def __init__(self):
         Instruction.__init__(self)
 #        self.save(locals(),'rt ra rc rb')
@@ -80,6 +98,7 @@ def fpeaddr_aligned(ra,x):
 
 class inspect(Instruction):
     '''Not a real instruction, handy for debugging'''
+    __slots__ = ()
     def __init__(self):
         Instruction.__init__(self,pragmatic=True)
     def run(self,c):
@@ -87,6 +106,7 @@ class inspect(Instruction):
 
 class fpset2(Instruction):
     '''Not a real instruction, but handy for debugging/prologue'''
+    __slots__ = ('frt', 'p', 's')
     def __init__(self,frt,p,s):
         Instruction.__init__(self,pragmatic=True)
         p, s = float(p), float(s)
@@ -98,6 +118,7 @@ class fpset2(Instruction):
 
 class intset(Instruction):
     '''Not a real instruction, but handy for debugging/prologue'''
+    __slots__ = ('ra', 'val')
     def __init__(self,ra,val):
         Instruction.__init__(self,pragmatic=True)
         val = int(val)
@@ -105,9 +126,11 @@ class intset(Instruction):
         self.iwrites(ra)
         self.uses(PPC.INT,1)
     def run(self,c):
-        c.int[self.ra] = IntVal(self.val)
+        c.int[c.get_intregister(self.ra)] = IntVal(self.val)
 
 class fmr(Instruction):
+    __slots__ = ('frt', 'frb')
+    merges = True
     def __init__(self,frt,frb):
         Instruction.__init__(self)
         self.save(locals(),'frt frb')
@@ -119,6 +142,9 @@ class fmr(Instruction):
         c.fp[c.get_fpregister(self.frt)] = FPVal(frb.p, frt.s)
         
 class fxcxma(Instruction):
+    __slots__ = ('rt', 'ra', 'rc', 'rb')
+    kind = 'fp'
+    flops = 4
     def __init__(self,rt,ra,rc,rb):
         Instruction.__init__(self)
         self.save(locals(),'rt ra rc rb')
@@ -132,6 +158,9 @@ class fxcxma(Instruction):
 
 class fxmul(Instruction):
     '''Floating Cross Multiply     fxmul  AS*CP -> TP, AP*CS -> TS'''
+    __slots__ = ('rt', 'ra', 'rc')
+    kind = 'fp'
+    flops = 2
     def __init__(self,rt,ra,rc):
         Instruction.__init__(self)
         self.save(locals(),'rt ra rc')
@@ -144,6 +173,9 @@ class fxmul(Instruction):
                                                 ra.p * rc.s)
     
 class fxcpmadd(Instruction):
+    __slots__ = ('rt', 'ra', 'rc', 'rb')
+    kind = 'fp'
+    flops = 4
     def __init__(self,rt,ra,rc,rb):
         Instruction.__init__(self)
         self.save(locals(),'rt ra rc rb')
@@ -156,6 +188,9 @@ class fxcpmadd(Instruction):
                                                 ra.p * rc.s + rb.s)
 
 class fxpmul(Instruction):
+    __slots__ = ('rt', 'ra', 'rc')
+    kind = 'fp'
+    flops = 2
     def __init__(self,rt,ra,rc):
         Instruction.__init__(self)
         self.save(locals(),'rt ra rc')
@@ -168,6 +203,9 @@ class fxpmul(Instruction):
                                                 ra.p * rc.s)
 
 class fadd(Instruction):
+    __slots__ = ('rt', 'ra', 'rb')
+    kind = 'fp'
+    flops = 2
     def __init__(self,rt,ra,rb):
         Instruction.__init__(self)
         self.save(locals(),'rt ra rb')
@@ -180,6 +218,8 @@ class fadd(Instruction):
                                                 ra.s + rb.s)
 
 class lfpdux(Instruction):
+    __slots__ = ('frt', 'ra', 'rb')
+    kind = 'load'
     def __init__(self,frt,ra,rb):
         Instruction.__init__(self)
         self.save(locals(),'frt ra rb')
@@ -189,11 +229,14 @@ class lfpdux(Instruction):
         self.inuse(frt,fpreg_load_source_latency,fpreg_load_dest_latency)
         self.uses(PPC.LS,load_latency,2)
     def run(self,c):
-        ea = fpeaddr_aligned(c.int[self.ra],c.int[self.rb])
+        ea = fpeaddr_aligned(c.int[c.get_intregister(self.ra)],c.int[c.get_intregister(self.rb)])
+        c.access(ea)
         c.fp[c.get_fpregister(self.frt)] = FPVal(c.mem[ea], c.mem[ea+1])
-        c.int[self.ra] = IntVal(ea*PPC.WORD_SIZE)
+        c.int[c.get_intregister(self.ra)] = IntVal(ea*PPC.WORD_SIZE)
 
 class lfxdux(Instruction):
+    __slots__ = ('frt', 'ra', 'rb')
+    kind = 'load'
     def __init__(self,frt,ra,rb):
         Instruction.__init__(self)
         self.save(locals(),'frt ra rb')
@@ -203,11 +246,14 @@ class lfxdux(Instruction):
         self.inuse(frt,fpreg_load_source_latency,fpreg_load_dest_latency)
         self.uses(PPC.LS,load_latency,2)
     def run(self,c):
-        ea = fpeaddr_aligned(c.int[self.ra],c.int[self.rb])
+        ea = fpeaddr_aligned(c.int[c.get_intregister(self.ra)],c.int[c.get_intregister(self.rb)])
+        c.access(ea)
         c.fp[c.get_fpregister(self.frt)] = FPVal(c.mem[ea+1], c.mem[ea])
-        c.int[self.ra] = IntVal(ea*PPC.WORD_SIZE)
+        c.int[c.get_intregister(self.ra)] = IntVal(ea*PPC.WORD_SIZE)
 
 class lfpdu(Instruction):
+    __slots__ = ('frt', 'ra', 'd')
+    kind = 'load'
     def __init__(self,frt,ra,d):
         Instruction.__init__(self)
         self.save(locals(),'frt ra d')
@@ -217,11 +263,14 @@ class lfpdu(Instruction):
         self.inuse(frt,fpreg_load_source_latency,fpreg_load_dest_latency)
         self.uses(PPC.LS,load_latency,2)
     def run(self,c):
-        ea = fpeaddr_aligned(c.int[self.ra],self.d)
+        ea = fpeaddr_aligned(c.int[c.get_intregister(self.ra)],self.d)
+        c.access(ea)
         c.fp[c.get_fpregister(self.frt)] = FPVal(c.mem[ea], c.mem[ea+1])
-        c.int[self.ra] = IntVal(ea*8)
+        c.int[c.get_intregister(self.ra)] = IntVal(ea*8)
 
 class lfpd(Instruction):
+    __slots__ = ('frt', 'ra', 'd')
+    kind = 'load'
     def __init__(self,frt,ra,d):
         Instruction.__init__(self)
         self.save(locals(),'frt ra d')
@@ -230,10 +279,13 @@ class lfpd(Instruction):
         self.inuse(frt,fpreg_load_source_latency,fpreg_load_dest_latency)
         self.uses(PPC.LS,load_latency,2)
     def run(self,c):
-        ea = fpeaddr_aligned(c.int[self.ra],self.d)
+        ea = fpeaddr_aligned(c.int[c.get_intregister(self.ra)],self.d)
+        c.access(ea)
         c.fp[c.get_fpregister(self.frt)] = FPVal(c.mem[ea], c.mem[ea+1])
 
 class lfpdx(Instruction):
+    __slots__ = ('frt', 'ra', 'rb')
+    kind = 'load'
     def __init__(self,frt,ra,rb):
         Instruction.__init__(self)
         self.save(locals(),'frt ra rb')
@@ -242,10 +294,14 @@ class lfpdx(Instruction):
         self.inuse(frt,fpreg_load_source_latency,fpreg_load_dest_latency)
         self.uses(PPC.LS,load_latency,2)
     def run(self,c):
-        ea = fpeaddr_aligned(c.int[self.ra],c.int[self.rb])
+        ea = fpeaddr_aligned(c.int[c.get_intregister(self.ra)],c.int[c.get_intregister(self.rb)])
+        c.access(ea)
         c.fp[c.get_fpregister(self.frt)] = FPVal(c.mem[ea], c.mem[ea+1])
 
 class lfd(Instruction):
+    __slots__ = ('frt', 'ra', 'd')
+    kind = 'load'
+    merges = True
     def __init__(self,frt,ra,d):
         Instruction.__init__(self)
         self.save(locals(),'frt ra d')
@@ -254,11 +310,15 @@ class lfd(Instruction):
         self.inuse(frt,fpreg_load_source_latency,fpreg_load_dest_latency)
         self.uses(PPC.LS,load_latency,2)
     def run(self,c):
-        ea = fpeaddr(c.int[self.ra],self.d)
+        ea = fpeaddr(c.int[c.get_intregister(self.ra)],self.d)
+        c.access(ea)
         frt = c.get_fpregister(self.frt)
         c.fp[frt] = FPVal(c.mem[ea], c.fp[frt].s)
 
 class lfdu(Instruction):
+    __slots__ = ('frt', 'ra', 'd')
+    kind = 'load'
+    merges = True
     def __init__(self,frt,ra,d):
         Instruction.__init__(self)
         self.save(locals(),'frt ra d')
@@ -268,12 +328,16 @@ class lfdu(Instruction):
         self.inuse(frt,fpreg_load_source_latency,fpreg_load_dest_latency)
         self.uses(PPC.LS,load_latency,2)
     def run(self,c):
-        ea = fpeaddr(c.int[self.ra],self.d)
+        ea = fpeaddr(c.int[c.get_intregister(self.ra)],self.d)
+        c.access(ea)
         frt = c.get_fpregister(self.frt)
         c.fp[frt] = FPVal(c.mem[ea], c.fp[frt].s)
-        c.int[self.ra] = IntVal(ea*8)
+        c.int[c.get_intregister(self.ra)] = IntVal(ea*8)
 
 class lfdux(Instruction):
+    __slots__ = ('frt', 'ra', 'rb')
+    kind = 'load'
+    merges = True
     def __init__(self,frt,ra,rb):
         Instruction.__init__(self)
         self.save(locals(),'frt ra rb')
@@ -283,12 +347,16 @@ class lfdux(Instruction):
         self.inuse(frt,fpreg_load_source_latency,fpreg_load_dest_latency)
         self.uses(PPC.LS,load_latency,2)
     def run(self,c):
-        ea = fpeaddr(c.int[self.ra],c.int[self.rb])
+        ea = fpeaddr(c.int[c.get_intregister(self.ra)],c.int[c.get_intregister(self.rb)])
+        c.access(ea)
         frt = c.get_fpregister(self.frt)
         c.fp[frt] = FPVal(c.mem[ea], c.fp[frt].s)
-        c.int[self.ra] = IntVal(ea*8)
+        c.int[c.get_intregister(self.ra)] = IntVal(ea*8)
 
 class lfsdux(Instruction):
+    __slots__ = ('frt', 'ra', 'rb')
+    kind = 'load'
+    merges = True
     def __init__(self,frt,ra,rb):
         Instruction.__init__(self)
         self.save(locals(),'frt ra rb')
@@ -298,12 +366,16 @@ class lfsdux(Instruction):
         self.inuse(frt,fpreg_load_source_latency,fpreg_load_dest_latency)
         self.uses(PPC.LS,load_latency,2)
     def run(self,c):
-        ea = fpeaddr(c.int[self.ra],c.int[self.rb])
+        ea = fpeaddr(c.int[c.get_intregister(self.ra)],c.int[c.get_intregister(self.rb)])
+        c.access(ea)
         frt = c.get_fpregister(self.frt)
         c.fp[frt] = FPVal(c.fp[frt].p, c.mem[ea])
-        c.int[self.ra] = IntVal(ea*8)
+        c.int[c.get_intregister(self.ra)] = IntVal(ea*8)
 
 class lfdx(Instruction):
+    __slots__ = ('frt', 'ra', 'rb')
+    kind = 'load'
+    merges = True
     def __init__(self,frt,ra,rb):
         Instruction.__init__(self)
         self.save(locals(),'frt ra rb')
@@ -312,11 +384,15 @@ class lfdx(Instruction):
         self.inuse(frt,fpreg_load_source_latency,fpreg_load_dest_latency)
         self.uses(PPC.LS,load_latency,2)
     def run(self,c):
-        ea = fpeaddr(c.int[self.ra],c.int[self.rb])
+        ea = fpeaddr(c.int[c.get_intregister(self.ra)],c.int[c.get_intregister(self.rb)])
+        c.access(ea)
         frt = c.get_fpregister(self.frt)
         c.fp[frt] = FPVal(c.mem[ea], c.fp[frt].s)        
 
 class lfsdx(Instruction):
+    __slots__ = ('frt', 'ra', 'rb')
+    kind = 'load'
+    merges = True
     def __init__(self,frt,ra,rb):
         Instruction.__init__(self)
         self.save(locals(),'frt ra rb')
@@ -325,11 +401,14 @@ class lfsdx(Instruction):
         self.inuse(frt,fpreg_load_source_latency,fpreg_load_dest_latency)
         self.uses(PPC.LS,load_latency,2)
     def run(self,c):
-        ea = fpeaddr(c.int[self.ra],c.int[self.rb])
+        ea = fpeaddr(c.int[c.get_intregister(self.ra)],c.int[c.get_intregister(self.rb)])
+        c.access(ea)
         frt = c.get_fpregister(self.frt)
         c.fp[frt] = FPVal(c.fp[frt].p, c.mem[ea])        
 
 class stfxdux(Instruction):
+    __slots__ = ('frs', 'ra', 'rb')
+    kind = 'store'
     def __init__(self,frs,ra,rb):
         Instruction.__init__(self)
         self.save(locals(),'frs ra rb')
@@ -339,13 +418,16 @@ class stfxdux(Instruction):
         self.inuse(frs,fpreg_store_source_latency,fpreg_store_dest_latency)
         self.uses(PPC.LS,store_latency,store_cycles,writethrough=16)
     def run(self,c):
-        ea = fpeaddr(c.int[self.ra],c.int[self.rb])
+        ea = fpeaddr(c.int[c.get_intregister(self.ra)],c.int[c.get_intregister(self.rb)])
+        c.access(ea,store=True)
         (frs,) = c.access_fpregisters(self.frs)
         c.mem[ea] = frs.s
         c.mem[ea+1] = frs.p
-        c.int[self.ra] = IntVal(ea*8)
+        c.int[c.get_intregister(self.ra)] = IntVal(ea*8)
         
 class stfpdux(Instruction):
+    __slots__ = ('frs', 'ra', 'rb')
+    kind = 'store'
     def __init__(self,frs,ra,rb):
         Instruction.__init__(self)
         self.save(locals(),'frs ra rb')
@@ -355,8 +437,9 @@ class stfpdux(Instruction):
         self.inuse(frs,fpreg_store_source_latency,fpreg_store_dest_latency)
         self.uses(PPC.LS,store_latency,store_cycles,writethrough=16)
     def run(self,c):
-        ea = fpeaddr(c.int[self.ra],c.int[self.rb])
+        ea = fpeaddr(c.int[c.get_intregister(self.ra)],c.int[c.get_intregister(self.rb)])
+        c.access(ea,store=True)
         (frs,) = c.access_fpregisters(self.frs)
         c.mem[ea] = frs.p
         c.mem[ea+1] = frs.s
-        c.int[self.ra] = IntVal(ea*8)
+        c.int[c.get_intregister(self.ra)] = IntVal(ea*8)
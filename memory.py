@@ -0,0 +1,74 @@
+'''Simulated memory backed by NumPy arrays or memory-mapped files
+
+    c = Core(mem=np.zeros(10**8))                 # Wrapped automatically
+    c = Core(mem=open_memory('grid.dat','r+'))    # Results written in place
+
+Indexing goes straight to the array, without copying, and behaves like
+the default list of doubles: reads give Python floats and out of range
+accesses raise the same IndexError.'''
+import numpy as np
+
+class ArrayMemory:
+    def __init__(self,array):
+        if not isinstance(array,np.ndarray) or array.dtype != np.float64 or array.ndim != 1:
+            raise Exception('Memory must be a 1-D float64 array, got %r' % (array,))
+        self.array = array
+    def __len__(self):
+        return len(self.array)
+    def __getitem__(self,i):
+        try:
+            if isinstance(i,slice):
+                return self.array[i].tolist()
+            return float(self.array[i])
+        except IndexError:
+            raise IndexError('list index out of range') from None
+    def __setitem__(self,i,val):
+        try:
+            if isinstance(i,slice) and not isinstance(val,(list,tuple,np.ndarray)):
+                val = list(val)
+            self.array[i] = val
+        except IndexError:
+            raise IndexError('list assignment index out of range') from None
+    def __iter__(self):
+        return iter(self.array.tolist())
+    def __eq__(self,other):
+        return list(self) == list(other)
+    def __repr__(self):
+        if isinstance(self.array,np.memmap):
+            return 'ArrayMemory(memmap(%r, %d doubles))' % (self.array.filename,len(self))
+        return 'ArrayMemory(%d doubles)' % (len(self),)
+    def flush(self):
+        'Write changes back to the file, for a memmap'
+        if isinstance(self.array,np.memmap):
+            self.array.flush()
+
+def open_memory(path,mode='r+',offset=0,size=None):
+    '''Memory over size doubles of a file of native float64s, starting offset
+    bytes in.  Mode 'r+' writes results back in place, 'c' keeps them in
+    memory, and 'w+' creates the file (size is then required).'''
+    shape = (size,) if size is not None else None
+    return ArrayMemory(np.memmap(path,dtype=np.float64,mode=mode,offset=offset,shape=shape))
+
+def test(size=1<<20):
+    import os
+    import tempfile
+    from simasm import isa
+    from simasm.simulate import Core
+    path = os.path.join(tempfile.mkdtemp(),'grid.dat')
+    mem = open_memory(path,'w+',size=size)
+    mem.array[-4:] = (1.0,2.0,3.0,4.0)
+    c = Core(mem=mem)
+    c.execute([isa.intset('p',8*(size-4)), isa.intset('q',8*(size-6)), isa.intset('sixteen',16),
+               isa.lfpd('x','p',0), isa.fadd('y','x','x'),
+               isa.stfxdux('y','q','sixteen')]) # Stores the lanes swapped
+    mem.flush()
+    print(np.fromfile(path)[-4:], '(expected [4. 2. 3. 4.])')
+    for (label,code) in (('bounds',[isa.intset('p',8*size), isa.lfpd('x','p',0)]),
+                         ('alignment',[isa.intset('p',8*(size-3)), isa.lfpd('x','p',0)])):
+        try:
+            Core(mem=mem).execute(code)
+        except Exception as e:
+            print('%s: %s: %s' % (label,e.__class__.__name__,e))
+
+if __name__ == '__main__':
+    test()
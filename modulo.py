@@ -0,0 +1,176 @@
+'''Modulo scheduling (software pipelining) of a loop body.
+
+Successive iterations are overlapped, starting a new one every II cycles.
+Dependences come from schedule.DependenceGraph over two copies of the
+body, the edges into the second copy being loop-carried.  The same
+register names are reused by every iteration, so loop-carried WAR/WAW
+edges keep overlapping iterations from clobbering each other.'''
+import heapq
+from collections import defaultdict
+from simasm.schedule import DependenceGraph
+
+class ModuloSchedule:
+    def __init__(self,body,ii,times,res_mii,rec_mii):
+        self.body = body
+        self.ii = ii
+        start = min(times)
+        self.times = [t - start for t in times] # Issue time of each op within an iteration
+        self.res_mii = res_mii
+        self.rec_mii = rec_mii
+    @property
+    def stages(self):
+        return max(self.times) // self.ii + 1
+    def __repr__(self):
+        return 'ModuloSchedule(ii=%d, res_mii=%d, rec_mii=%d, stages=%d)' % (self.ii,self.res_mii,self.rec_mii,self.stages)
+    def issue_order(self,iterations):
+        'All (time, iteration, op index) of iterations overlapped iterations, in issue order'
+        return sorted((k*self.ii + t,k,i) for k in range(iterations) for (i,t) in enumerate(self.times))
+    def code(self,iterations):
+        'Straight-line code for iterations overlapped iterations'
+        return [self.body[i] for (t,k,i) in self.issue_order(iterations)]
+    def emit(self,c,iterations):
+        '''Inline asm for iterations (at least stages) iterations: the
+        prologue, the kernel, which is repeated iterations-stages+1 times,
+        and the epilogue'''
+        if iterations < self.stages:
+            raise Exception('Need at least %d iterations to fill the pipeline' % (self.stages,))
+        order = self.issue_order(self.stages)
+        fill = (self.stages - 1) * self.ii
+        def lines(ops):
+            return ['%s\n' % c.cv.named_view(self.body[i]) for (t,k,i) in ops if not self.body[i].pragmatic]
+        prologue = [op for op in order if op[0] < fill]
+        kernel = sorted((t % self.ii,-(t // self.ii),i) for (i,t) in enumerate(self.times))
+        epilogue = [(t,k,i) for (t,k,i) in self.issue_order(iterations) if t >= iterations * self.ii]
+        return ''.join(['    // prologue: %d stages\n' % (self.stages - 1)] + lines(prologue)
+                       + ['    // kernel: II=%d, repeat %d times\n' % (self.ii,iterations - self.stages + 1)] + lines(kernel)
+                       + ['    // epilogue\n'] + lines(epilogue))
+
+def loop_graph(body):
+    '''Edges (successor, distance, iterations) of the loop body, iterations
+    being 1 for loop-carried dependences'''
+    n = len(body)
+    dag = DependenceGraph(list(body) + list(body))
+    edges = [[] for instr in body]
+    for i in range(n):
+        for (j,distance) in dag.succs[i]:
+            if j < n:
+                edges[i].append((j,distance,0))
+            else:
+                edges[i].append((j-n,distance,1))
+    return edges
+
+def resource_mii(body):
+    'Lower bound on II from the cycles each unit is occupied per iteration'
+    work = defaultdict(int)
+    for instr in body:
+        work[instr.unit] += instr.ithroughput
+    return max(work.values())
+
+def feasible(edges,ii):
+    'True if no dependence cycle needs more than ii cycles per iteration'
+    n = len(edges)
+    est = [0]*n
+    for sweep in range(n+1):
+        changed = False
+        for i in range(n):
+            for (j,distance,k) in edges[i]:
+                if est[i] + distance - ii*k > est[j]:
+                    est[j] = est[i] + distance - ii*k
+                    changed = True
+        if not changed:
+            return True
+    return False
+
+def recurrence_mii(edges):
+    'Smallest II satisfying every dependence cycle'
+    lo, hi = 1, 1 + sum(distance for succs in edges for (j,distance,k) in succs)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if feasible(edges,mid):
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+def iterative_schedule(body,edges,ii,budget):
+    '''Rau's iterative modulo scheduling: place ops by height in the first
+    slot of their window whose unit is free modulo ii, evicting conflicting
+    ops when there is none.  Returns the issue times or None.'''
+    n = len(body)
+    preds = [[] for i in range(n)]
+    for i in range(n):
+        for (j,distance,k) in edges[i]:
+            preds[j].append((i,distance,k))
+    heights = [0]*n
+    for sweep in range(n):     # Longest path ignoring loop-carried edges
+        for i in reversed(range(n)):
+            heights[i] = max([heights[i]] + [distance + heights[j] for (j,distance,k) in edges[i] if k == 0])
+    times = [None]*n
+    last = [None]*n
+    mrt = dict()                # (unit, slot) -> op
+    def slots(i,t):
+        return [(body[i].unit,(t + c) % ii) for c in range(body[i].ithroughput)]
+    def unschedule(i):
+        for s in slots(i,times[i]):
+            del mrt[s]
+        times[i] = None
+        heapq.heappush(queue,(-heights[i],i))
+    queue = [(-heights[i],i) for i in range(n)]
+    heapq.heapify(queue)
+    while queue:
+        if budget == 0:
+            return None
+        budget -= 1
+        (h,i) = heapq.heappop(queue)
+        if times[i] is not None:
+            continue
+        estart = max([0] + [times[p] + distance - ii*k for (p,distance,k) in preds[i] if times[p] is not None])
+        t = next((t for t in range(estart,estart + ii) if all(s not in mrt for s in slots(i,t))),None)
+        if t is None:
+            t = estart if last[i] is None or last[i] < estart else last[i] + 1
+        for s in slots(i,t):
+            if s in mrt:
+                unschedule(mrt[s])
+        for (j,distance,k) in edges[i]:
+            if times[j] is not None and j != i and times[j] < t + distance - ii*k:
+                unschedule(j)
+        times[i] = last[i] = t
+        for s in slots(i,t):
+            mrt[s] = i
+    return times
+
+def modulo_schedule(body,max_ii=None,budget=None):
+    '''Modulo schedule of one loop iteration (a list of instructions), with
+    the smallest II for which iterative scheduling succeeds'''
+    body = list(body)
+    edges = loop_graph(body)
+    res_mii = resource_mii(body)
+    rec_mii = recurrence_mii(edges)
+    if max_ii is None:
+        max_ii = sum(max([1] + [distance for (j,distance,k) in succs]) for succs in edges) + res_mii
+    if budget is None:
+        budget = 8*len(body)
+    for ii in range(max(res_mii,rec_mii),max_ii+1):
+        times = iterative_schedule(body,edges,ii,budget)
+        if times is not None:
+            return ModuloSchedule(body,ii,times,res_mii,rec_mii)
+    raise Exception('No modulo schedule with II <= %d' % (max_ii,))
+
+def test(iterations=20):
+    import itertools
+    from simasm.simulate import VirtualCore, stencil, stencil_body
+    body = list(stencil_body())
+    ms = modulo_schedule(body)
+    print('%r: achieved II=%d against resource-bound minimum %d (recurrence bound %d)'
+          % (ms,ms.ii,ms.res_mii,ms.rec_mii))
+    prologue = list(itertools.islice(stencil(),2))
+    for (label,code) in (('modulo',ms.code(iterations)),('straight-line',body*iterations)):
+        c = VirtualCore(timing_only=True)
+        c.execute(prologue)
+        cycles = c.execute(code)
+        print('%-14s %d iterations in %d cycles, %.1f per iteration' % (label,iterations,cycles,cycles/iterations))
+    c = VirtualCore()
+    print(ms.emit(c,iterations)[:2000])
+
+if __name__ == '__main__':
+    test()
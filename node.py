@@ -0,0 +1,177 @@
+'''A node of several cores sharing store bandwidth
+
+    node = Node(stencil_partition,ncores=4)
+    print(node.run())
+
+Each core runs its own instruction stream on its own partition of the
+grid; setup(rank, ncores) builds the Core and the stream.  The cores are
+advanced in lockstep epochs, each in its own worker process.  After every
+epoch the stores of all cores (their WriteThrough bytes) are compared with
+the node's bandwidth.  When they exceed it, each core gets a share of the
+bandwidth in proportion to its stores, enforced for the next epoch by
+stretching its WriteThrough latency so that its tokens cannot store any
+faster.  Cores thus contend for the bandwidth one epoch late.  Loads are
+not coupled.'''
+import itertools
+import math
+import multiprocessing
+import traceback
+from collections import namedtuple
+from simasm import isa
+
+NodeResult = namedtuple('NodeResult','cycles bytes epochs bandwidth')
+
+class CoreRunner:
+    'One core and its instruction stream, advanced an epoch at a time'
+    def __init__(self,setup,rank,ncores):
+        self.core, code = setup(rank,ncores)
+        self.code = iter(code)
+        self.latency = self.core.writethrough.latency
+    def advance(self,until,share=None):
+        '''Issue instructions until the core reaches cycle until, storing at most
+        share bytes per cycle (None for no limit).  Returns its cycle, the bytes
+        it stored and whether its stream is exhausted.'''
+        c = self.core
+        wt = c.writethrough
+        wt.latency = self.latency
+        if share is not None:
+            wt.latency = max(self.latency,math.ceil(wt.maxtokens*Node.token_bytes/share))
+        start = c.writethrough.total_bytes
+        done = False
+        while c.cycle < until:
+            instr = next(self.code,None)
+            if instr is None:
+                done = True
+                break
+            c.execute_one(instr)
+        return c.cycle, c.writethrough.total_bytes - start, done
+
+def serve(conn,setup,rank,ncores):
+    '''Worker loop: advance the core for each request until None.  An
+    exception is sent back in place of the reply, for Node to re-raise.'''
+    try:
+        runner = CoreRunner(setup,rank,ncores)
+        for args in iter(conn.recv,None):
+            conn.send(runner.advance(*args))
+    except Exception as e:
+        e.add_note('in core %d:\n%s' % (rank,traceback.format_exc()))
+        try:
+            conn.send(e)
+        except Exception:       # Not picklable
+            conn.send(Exception('%s: %s' % (type(e).__name__,e),*e.__notes__))
+    conn.close()
+
+class Node:
+    token_bytes = 16            # Bytes stored per WriteThrough token by the isa stores
+    def __init__(self,setup,ncores=4,epoch=1000,bandwidth=8.0,processes=True):
+        self.setup = setup
+        self.ncores = ncores
+        self.epoch = epoch                # Cycles between exchanges
+        self.bandwidth = bandwidth        # Bytes per cycle stored by all cores together
+        self.processes = processes        # Run each core in a worker process
+    def shares(self,demand):
+        '''Bytes per cycle each core may store given the bytes each stored in
+        the last epoch, None where it need not be throttled'''
+        total = sum(demand)
+        if total <= self.bandwidth*self.epoch:
+            return [None]*self.ncores
+        return [self.bandwidth*nbytes/total if nbytes else None for nbytes in demand]
+    def run(self):
+        if self.processes:
+            conns = []
+            workers = []
+            for rank in range(self.ncores):
+                (conn,child) = multiprocessing.Pipe()
+                workers.append(multiprocessing.Process(target=serve,args=(child,self.setup,rank,self.ncores),daemon=True))
+                workers[-1].start()
+                conns.append(conn)
+            def advance(ranks,until,shares):
+                for rank in ranks:
+                    conns[rank].send((until,shares[rank]))
+                replies = [conns[rank].recv() for rank in ranks]
+                for reply in replies:
+                    if isinstance(reply,Exception):
+                        raise reply
+                return replies
+        else:
+            runners = [CoreRunner(self.setup,rank,self.ncores) for rank in range(self.ncores)]
+            def advance(ranks,until,shares):
+                return [runners[rank].advance(until,shares[rank]) for rank in ranks]
+        try:
+            cycles = [0]*self.ncores
+            stored = [0]*self.ncores
+            active = list(range(self.ncores))
+            shares = [None]*self.ncores
+            for epoch in itertools.count(1):
+                replies = advance(active,epoch*self.epoch,shares)
+                demand = [0]*self.ncores
+                for (rank,(cycle,nbytes,done)) in zip(list(active),replies):
+                    cycles[rank] = cycle
+                    stored[rank] += nbytes
+                    demand[rank] = nbytes
+                    if done:
+                        active.remove(rank)
+                if not active:
+                    break
+                shares = self.shares(demand)
+        finally:
+            if self.processes:
+                for conn in conns:
+                    try:
+                        conn.send(None)
+                    except OSError: # The worker already quit after an exception
+                        pass
+                for worker in workers:
+                    worker.join()
+        return NodeResult(cycles,stored,epoch,sum(stored)/max(cycles) if max(cycles) else 0.0)
+
+def stencil_partition(rank,ncores,iterations=50,row=1024):
+    '''The stencil over the rows of a grid of ncores + 2, rank reading rows
+    rank to rank + 2, storing the three accumulators every iteration to its
+    own part of the output after the grid'''
+    from simasm.simulate import VirtualCore, stencil_body
+    out = 6*iterations + 16     # Doubles of output per rank
+    c = VirtualCore(mem=[0.0]*((ncores + 2)*row + ncores*out))
+    setup = [isa.intset('p_%d_%d' % (i,j),8*row*(rank + i) + 16*j) for i in range(3) for j in range(3)]
+    setup += [isa.intset('q',8*((ncores + 2)*row + rank*out)), isa.intset('sixteen',16),
+              isa.fpset2('w01',1/9,2/9), isa.fpset2('w2x',1/9,9)]
+    def code():
+        for instr in setup:
+            yield instr
+        for k in range(iterations):
+            for instr in stencil_body():
+                yield instr
+            for r in ('r_1_1_21','r_1_1_43','r_1_1_65'):
+                yield isa.stfpdux(r,'q','sixteen')
+    return c, code()
+
+def scale_partition(rank,ncores,n=4096):
+    'y = 2 x over n doubles of x and y per rank, limited by stores'
+    from simasm.simulate import Core
+    c = Core(mem=[1.0]*(2*n*ncores + 4))
+    def code():
+        yield isa.intset('x',8*n*rank - 16)
+        yield isa.intset('y',8*n*(ncores + rank) - 16)
+        yield isa.intset('sixteen',16)
+        yield isa.fpset2('two',2,2)
+        for k in range(n//2):
+            yield isa.lfpdu('a','x',16)
+            yield isa.fxpmul('b','two','a')
+            yield isa.stfpdux('b','y','sixteen')
+    return c, code()
+
+def test(ncores=4):
+    import time
+    for setup in (stencil_partition,scale_partition):
+        for (label,kwargs) in (('one core',dict(ncores=1,processes=False)),
+                               ('serial',dict(ncores=ncores,processes=False)),
+                               ('processes',dict(ncores=ncores)),
+                               ('4 bytes/cycle',dict(ncores=ncores,bandwidth=4.0)),
+                               ('no contention',dict(ncores=ncores,bandwidth=float('inf')))):
+            start = time.perf_counter()
+            r = Node(setup,**kwargs).run()
+            print('%-17s %-14s %5.2fs  cycles %s, %d epochs, %.2f bytes/cycle'
+                  % (setup.__name__,label,time.perf_counter() - start,r.cycles,r.epochs,r.bandwidth))
+
+if __name__ == '__main__':
+    test()
@@ -1,3 +1,5 @@
+import itertools
+from array import array
 from collections import namedtuple
 
 # Register contents
@@ -9,6 +11,8 @@ class Register:
     def __str__(self):
         return self.name
     def __eq__(self,x):
+        if not isinstance(x,Register):
+            return NotImplemented
         return self.name == x.name and self.num == x.num
     def __hash__(self):
         return hash((self.name,self.num))
@@ -40,30 +44,46 @@ class TrueRegister:
         return 'TrueRegister(%r=%r)' % (self.name,self.val)
 
 class RegisterFile:
+    '''Register contents packed in a flat array with one lane per field of
+    the register's value type (two for FPVal, one for IntVal).  Indexing
+    by register still reads and writes FPVal/IntVal tuples.'''
     def __init__(self,*args):
         if len(args) == 1:
-            self.bank = args[0]
+            bank = args[0]
+            self.names = [treg.name for treg in bank]
+            vals = [treg.val for treg in bank]
         else:
             cons, numregisters = args
-            def mk(i):
-                rname = cons(i)
-                return TrueRegister(rname,rname.empty())
-            self.bank = [mk(i) for i in range(numregisters)]
+            self.names = [cons(i) for i in range(numregisters)]
+            vals = [rname.empty() for rname in self.names]
+        self.regtype = type(self.names[0])
+        self.valtype = type(vals[0])
+        self.width = len(self.valtype._fields)
+        assert(self.width in (1,2))
+        typecode = 'd' if isinstance(vals[0][0],float) else 'q'
+        self.lanes = array(typecode,itertools.chain.from_iterable(vals))
+    def bank(self):
+        return [TrueRegister(rname,self[rname]) for rname in self.names]
     def __str__(self):
-        return 'RegisterFile(%s)' % ', '.join(str(treg) for treg in self.bank)
+        return 'RegisterFile(%s)' % ', '.join(str(treg) for treg in self.bank())
     def __repr__(self):
-        return 'RegisterFile(%r)' % (self.bank,)
+        return 'RegisterFile(%r)' % (self.bank(),)
     def __getitem__(self,reg):
-        treg = self.bank[reg.num]
-        assert(treg.name == reg)
-        return treg.val
+        assert(isinstance(reg,self.regtype))
+        n = reg.num*self.width
+        if self.width == 1:
+            return self.valtype(self.lanes[n])
+        return self.valtype(self.lanes[n],self.lanes[n+1])
     def __setitem__(self,reg,rval):
-        treg = self.bank[reg.num]
-        assert(treg.name == reg)
-        assert(isinstance(rval,treg.val.__class__))
-        treg.val = rval
+        assert(isinstance(reg,self.regtype))
+        assert(isinstance(rval,self.valtype))
+        n = reg.num*self.width
+        if self.width == 1:
+            self.lanes[n], = rval
+        else:
+            self.lanes[n],self.lanes[n+1] = rval
     def keys(self):
-        return (x.name for x in self.bank)
+        return iter(self.names)
     def get(self,*regs):
         return map(self.__getitem__,regs)
 
@@ -0,0 +1,132 @@
+'''Where the cycles of a kernel go
+
+    c = Core(profiler=Profiler())
+    c.execute(code)
+    print(c.profiler.report())
+
+The core only moves to a later cycle when the next instruction cannot
+issue, so every cycle waited is charged to the reason that binds, i.e.
+the one that alone would wait as long: the busy unit first, then RAW
+hazards, in-use source and destination registers, a full dispatch group
+and WriteThrough tokens.  Waiting on a unit is mostly just its issue
+throughput; cycles in which nothing issues are counted separately.
+Core.execute_loop simulates every iteration of a profiled loop rather
+than extrapolating, so that all cycles are charged.'''
+from collections import Counter
+from simasm.ppc import PPC, FPRegister
+
+UNITS = (PPC.FP,PPC.LS,PPC.INT)
+UNIT_BITS = dict((unit,1 << i) for (i,unit) in enumerate(UNITS))
+PEAK_FLOPS = 4                  # Double Hummer: two lanes of fused multiply-add per cycle
+
+class Profiler:
+    def __init__(self):
+        self.core = None        # Set by the core, along with its first cycle
+        self.start = None
+        self.issued = Counter() # unit -> instructions
+        self.busy = Counter()   # unit -> cycles occupied
+        self.flops = 0
+        self.causes = Counter() # (kind, unit or None) -> cycles waited
+        self.registers = Counter()    # (symbolic name, physical register) -> cycles waited
+        self.instructions = Counter() # instruction -> cycles waited
+        self.issue_cycles = Counter() # Units issuing (bitmask of UNIT_BITS) -> cycles
+        self.cycle = None       # Cycle of the last issue, and the units issuing in it
+        self.mask = 0
+    def charge(self,c,d,stall):
+        'Charge stall cycles to the reason d cannot issue on c'
+        instr = d.instr
+        self.instructions[instr] += stall
+        if c.units.stall((d.unit,)) == stall:
+            self.causes['units',d.unit] += stall
+            return
+        for (pipeline,kind,regs,names) in ((c.hazards,'hazards',d.read,instr.read),
+                                           (c.inuse_src,'inuse_src',d.read,instr.read),
+                                           (c.inuse_dst,'inuse_dst',d.write,instr.write)):
+            if pipeline.stall(regs) == stall:
+                for (reg,name) in zip(regs,names):
+                    if pipeline.stall((reg,)) == stall:
+                        self.causes[kind,None] += stall
+                        self.registers[name,FPRegister(reg)] += stall
+                        return
+        if c.dispatch is not None and c.dispatch.stall(d.unit) == stall:
+            self.causes['dispatch',None] += stall
+            return
+        self.causes['writethrough',None] += stall
+    def issue(self,c,d,stall):
+        'Called by Core.issue before it jumps stall cycles ahead'
+        if stall > 0:
+            self.charge(c,d,stall)
+        cycle = c.cycle + stall
+        if cycle != self.cycle:
+            if self.cycle is not None:
+                self.issue_cycles[self.mask] += 1
+            self.cycle, self.mask = cycle, 0
+        self.mask |= UNIT_BITS.get(d.unit,0)
+        self.issued[d.unit] += 1
+        self.busy[d.unit] += d.ithroughput
+        self.flops += d.instr.flops
+    def summary(self):
+        '''Totals as a plain dict.  cycles is counted as Core.execute does, up to
+        the cycle of the last issue, which is still open and so not in
+        issue_cycles.'''
+        cycles = self.core.cycle - self.start if self.core is not None else 0
+        issue_cycles = self.issue_cycles.copy()
+        issue_cycles[0] += cycles - sum(issue_cycles.values())
+        return dict(cycles=cycles,
+                    instructions=sum(self.issued.values()),
+                    waited=sum(self.causes.values()),
+                    idle=issue_cycles[0],
+                    flops=self.flops,
+                    flops_per_cycle=self.flops/cycles if cycles else 0.0,
+                    utilization=dict((unit,self.busy[unit]/cycles if cycles else 0.0) for unit in UNITS),
+                    issue_cycles=dict(('+'.join(unit for unit in UNITS if mask & UNIT_BITS[unit]) or 'none',n)
+                                      for (mask,n) in sorted(issue_cycles.items())),
+                    causes=dict(('%s %s' % cause if cause[1] else cause[0],n) for (cause,n) in self.causes.most_common()))
+    def report(self,top=5):
+        s = self.summary()
+        cycles = max(s['cycles'],1)
+        lines = ['%d cycles, %d instructions, %d cycles issuing nothing (%.1f%%)'
+                 % (s['cycles'],s['instructions'],s['idle'],100*s['idle']/cycles),
+                 '%-16s %7s %7s %12s' % ('unit','issued','busy','utilization')]
+        for unit in UNITS:
+            lines.append('%-16s %7d %7d %11.1f%%' % (unit,self.issued[unit],self.busy[unit],100*s['utilization'][unit]))
+        lines.append('%d flops, %.2f flops/cycle, %.1f%% of the %d flops/cycle peak'
+                     % (s['flops'],s['flops_per_cycle'],100*s['flops_per_cycle']/PEAK_FLOPS,PEAK_FLOPS))
+        lines.append('Cycles by units issuing: ' + ', '.join('%s %d' % item for item in s['issue_cycles'].items()))
+        lines.append('Cycles waited by cause:')
+        lines.extend('  %-28s %7d' % item for item in s['causes'].items())
+        lines.append('Registers waited on most:')
+        lines.extend('  %-28s %7d' % ('%s:%s' % reg,n) for (reg,n) in self.registers.most_common(top))
+        lines.append('Instructions waiting most:')
+        lines.extend('  %7d  %s' % (n,instr) for (instr,n) in self.instructions.most_common(top))
+        return '\n'.join(lines)
+
+def test():
+    'Every cycle is charged to exactly one cause and one set of units issuing'
+    import itertools
+    from simasm.simulate import Dispatch, VirtualCore, get_core, stencil, test_kernels
+    kernels = [(kernel.__name__,get_core,kernel) for kernel in test_kernels]
+    kernels.append(('stencil',lambda **kwargs: VirtualCore(timing_only=True,**kwargs),
+                    lambda c: list(itertools.islice(stencil(),300))))
+    for (name,core,kernel) in kernels:
+        for (label,kwargs) in (('',dict),(' scoreboard',lambda: dict(use_scoreboard=True)),
+                               (' dispatch',lambda: dict(dispatch=Dispatch()))):
+            c = core(profiler=Profiler(),**kwargs())
+            cycles = c.execute(kernel(c))
+            p = c.profiler
+            s = p.summary()
+            if s['cycles'] != cycles or s['waited'] != cycles:
+                raise Exception('%s%s: %d cycles waited of %d' % (name,label,s['waited'],cycles))
+            if s['idle'] < 0 or sum(s['issue_cycles'].values()) != cycles:
+                raise Exception('%s%s: cycles by units issuing do not sum to %d' % (name,label,cycles))
+            for unit in UNITS:
+                issuing = sum(n for (mask,n) in p.issue_cycles.items() if mask & UNIT_BITS[unit])
+                if issuing > p.issued[unit]:
+                    raise Exception('%s%s: %s issued in more cycles than instructions' % (name,label,unit))
+            registers = sum(n for (cause,n) in p.causes.items() if cause[0] in ('hazards','inuse_src','inuse_dst'))
+            if sum(p.registers.values()) != registers:
+                raise Exception('%s%s: register waits do not sum to their causes' % (name,label))
+            print('%s%s: %d cycles, %d idle, all charged' % (name,label,cycles,s['idle']))
+
+if __name__ == '__main__':
+    test()
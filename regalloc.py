@@ -0,0 +1,98 @@
+'''Liveness of symbolic FP register names, so Core can reuse registers
+
+    c.plan_registers(istream)
+    c.schedule(istream)
+
+A pass over the stream in program order counts the uses of every value
+of each name.  A value is used by instructions reading it, and by those
+writing it while reading it or keeping one lane (isa merges); any other
+write starts a new value.  Once the last use of a value issues, the name
+is dead and Core.gc returns its register to fppool, so the next value
+may land in another register.  A value nothing reads dies as soon as it
+is written; one whose last use rewrites it (an accumulator) stays put,
+so results can still be read off the core.  Schedulers preserve the order of writes to a name and of reads
+around them, so the counts hold in any order they issue.'''
+
+def accesses(instr):
+    'Names instr uses the current value of, and names it starts a new value of'
+    reads = [reg for reg in instr.read if isinstance(reg,str)]
+    writes = [reg for reg in instr.write if isinstance(reg,str)]
+    if instr.merges:
+        return reads + [reg for reg in writes if reg not in reads], []
+    return reads, [reg for reg in writes if reg not in reads]
+
+class Liveness:
+    def __init__(self,istream,pinned=()):
+        self.counts = dict()    # name -> uses of each value, the first being live in
+        for instr in istream:
+            used, defined = accesses(instr)
+            for name in used:
+                if name not in pinned:
+                    self.counts.setdefault(name,[0])[-1] += 1
+            for name in defined:
+                if name not in pinned:
+                    self.counts.setdefault(name,[0]).append(0)
+        self.value = dict((name,0) for name in self.counts) # Index of the current value
+        self.left = dict((name,counts[0]) for (name,counts) in self.counts.items())
+    def copy(self):
+        l = Liveness(())
+        l.counts = self.counts  # Never modified
+        l.value = dict(self.value)
+        l.left = dict(self.left)
+        return l
+    def issued(self,instr):
+        'Update for instr having issued, returning the names that died'
+        dead = []
+        used, defined = accesses(instr)
+        for name in used:
+            if name in self.left:
+                self.left[name] -= 1
+                if self.left[name] == 0 and name not in instr.write:
+                    dead.append(name)
+        for name in defined:
+            if name in self.value:
+                self.value[name] += 1
+                self.left[name] = self.counts[name][self.value[name]]
+                if self.left[name] == 0:
+                    dead.append(name) # Never read, or overwritten before it is
+        return dead
+
+def test(n=48):
+    '''A dot product with a fresh name per element, needing 2n registers
+    without reuse, and an iteration of the stencil, whose loads run far
+    ahead of the FMAs.  Both must fit a 32 register Core and agree with a
+    VirtualCore, which never reuses.'''
+    import random
+    from simasm import isa
+    from simasm.simulate import Core, VirtualCore, stencil_body
+    from simasm.node import stencil_partition
+    dot = [isa.intset('py',16*n), isa.fpset2('r',0,0)]
+    for k in range(n):
+        dot += [isa.lfpdu('x_%d' % k,'px',16), isa.lfpdu('y_%d' % k,'py',16),
+                isa.fxcpmadd('r','x_%d' % k,'y_%d' % k,'r')]
+    body = list(stencil_body())
+    # Values the body takes from the previous iteration, set here so they do not depend on the register
+    livein = [name for (name,counts) in Liveness(body).counts.items() if counts[0]]
+    stencil = (list(stencil_partition(0,1,iterations=1)[1])[:13]
+               + [isa.fpset2(name,random.random(),random.random()) for name in livein if name[0] != 'w'] + body)
+    mem = [random.random() for i in range(8192)]
+    for (kernel,results,modes) in ((dot,['r'],('execute','schedule','dag')),
+                                   (stencil,[name for name in livein if name[0] == 'r'],('schedule','dag'))):
+        ref = VirtualCore(mem=list(mem))
+        ref.execute(list(kernel))
+        for mode in modes:
+            c = Core(mem=list(mem))   # Raises if the kernel needs more registers
+            c.plan_registers(kernel)
+            if mode == 'execute':
+                c.execute(list(kernel))
+            else:
+                c.schedule(list(kernel),use_dag=(mode == 'dag'))
+            for name in results:
+                if c.fp[c.regnames[name]] != ref.fp[ref.regnames[name]]:
+                    raise Exception('%s: %s=%s, expected %s'
+                                    % (mode,name,c.fp[c.regnames[name]],ref.fp[ref.regnames[name]]))
+            print('%d instructions, %d names, %s on a %d register Core: %d cycles'
+                  % (len(kernel),len(Liveness(kernel).counts),mode,c.fpregisters,c.cycle))
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,191 @@
+'''Schedules kept on disk, keyed by what determines them
+
+    cache = ScheduleCache('~/.cache/simasm')
+    result = cache.schedule(c,istream)
+    print(result.cycles,result.hit,cache.stats)
+
+The key hashes the instructions (operands and timing), the core's
+register bindings, pipeline state and configuration, whether it emits asm,
+and the isa latency constants, so any change that could change the
+schedule or its asm misses.  An entry holds the issue order, the cycles
+and the inline asm.  On a hit the order is replayed on the core, which
+costs as much as Core.execute on it and so most of what scheduling would
+(about 30 ms against a 2 ms lookup for four stencil bodies); pass
+replay=False when the cycles and asm are all that is needed.  Entries
+are written to a temporary file and renamed into place, so processes can
+share a directory; the least recently used entries (by mtime, touched on
+every hit) are evicted once the directory exceeds max_bytes.'''
+import hashlib
+import json
+import os
+import tempfile
+from collections import Counter, namedtuple
+from simasm import isa
+from simasm.emit import ListEmitter, NullEmitter
+from simasm.schedule import list_schedule
+
+VERSION = 1                     # Bump when the schedulers change their choices
+CONSTANTS = ('load_latency','store_latency','fp_latency','store_cycles',
+             'fpreg_load_source_latency','fpreg_load_dest_latency',
+             'fpreg_store_source_latency','fpreg_store_dest_latency')
+
+CachedSchedule = namedtuple('CachedSchedule','order cycles inline_asm hit')
+
+def schedule_key(c,istream):
+    'Hex digest of everything Core.schedule(istream) depends on'
+    if c.hierarchy is not None or c.liveness is not None:
+        raise Exception('Schedules depending on a memory hierarchy or liveness cannot be cached')
+    h = hashlib.sha256()
+    def add(obj):
+        h.update(repr(obj).encode())
+        h.update(b'\n')
+    def ordered(items):
+        return sorted(items,key=repr)
+    add(VERSION)
+    add([(name,getattr(isa,name)) for name in CONSTANTS])
+    d = c.dispatch
+    add((type(c).__name__,c.fpregisters,c.intregisters,c.no_fma,
+         c.timing_only,c.emitter.enabled, # Entries from cores that emit nothing hold no asm
+         c.writethrough.maxtokens,c.writethrough.latency,
+         (d.width,ordered(d.pairs)) if d is not None else None))
+    add(ordered(c.regnames.items()))
+    add(ordered(c.fpeternal))
+    add(ordered(c.fppool))
+    add(ordered(c.intnames.items()))
+    for state in c.pipeline_state()[:-1]:
+        add(ordered(state) if isinstance(state,frozenset) else state)
+    for instr in istream:
+        add((type(instr).__name__,[getattr(instr,slot) for slot in instr.operands],
+             instr.unit,instr.latency,instr.ithroughput,instr.inuse_regs,instr.writethrough))
+    return h.hexdigest()
+
+class ScheduleCache:
+    def __init__(self,directory,max_bytes=256<<20):
+        self.directory = os.path.expanduser(directory)
+        self.max_bytes = max_bytes
+        self.stats = Counter()  # hits, misses, stores, evictions
+        os.makedirs(self.directory,exist_ok=True)
+    def path(self,key):
+        return os.path.join(self.directory,key + '.json')
+    def get(self,key):
+        'The entry for key as a dict, or None'
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            os.utime(path)      # Most recently used
+        except (FileNotFoundError,ValueError): # Missing, evicted meanwhile or truncated by hand
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return entry
+    def put(self,key,entry):
+        fd, tmp = tempfile.mkstemp(dir=self.directory,suffix='.tmp')
+        with os.fdopen(fd,'w') as f:
+            json.dump(entry,f)
+        os.replace(tmp,self.path(key))
+        self.stats['stores'] += 1
+        self.evict()
+    def entries(self):
+        'Paths, sizes and mtimes of all entries, least recently used first'
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.json'):
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime,entry.path,st.st_size))
+        return sorted(entries)
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for (mtime,path,size) in entries)
+        for (mtime,path,size) in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.stats['evictions'] += 1
+            except FileNotFoundError: # Another process got there first
+                pass
+            total -= size
+    def info(self):
+        'Statistics of this cache object and the totals on disk'
+        entries = self.entries()
+        lookups = self.stats['hits'] + self.stats['misses']
+        return dict(self.stats,entries=len(entries),bytes=sum(size for (mtime,path,size) in entries),
+                    hit_rate=self.stats['hits']/lookups if lookups else 0.0)
+    def clear(self):
+        for (mtime,path,size) in self.entries():
+            os.remove(path)
+    def schedule(self,c,istream,replay=True):
+        '''Schedule istream on c in the order of Core.schedule (either way),
+        unless the cache has its schedule.  Returns a CachedSchedule; on a hit
+        without replay, c is left untouched.  istream is left intact.'''
+        istream = list(istream)
+        key = schedule_key(c,istream)
+        entry = self.get(key)
+        if entry is not None:
+            if replay:
+                c.execute([istream[i] for i in entry['order']])
+            return CachedSchedule(entry['order'],entry['cycles'],entry['inline_asm'],True)
+        saved = c.emitter
+        lines = ListEmitter() if saved.enabled else saved
+        c.set_emitter(lines)
+        try:
+            cycle_start = c.cycle
+            order = list_schedule(c,istream)
+            cycles = c.cycle - cycle_start
+            asm = lines.getvalue() if saved.enabled else ''
+        finally:
+            c.set_emitter(saved)
+        if asm:
+            saved.write(asm)
+        self.put(key,dict(order=order,cycles=cycles,inline_asm=asm))
+        return CachedSchedule(order,cycles,asm,False)
+
+def test():
+    import time
+    from simasm.simulate import VirtualCore, stencil_body
+    from simasm.node import stencil_partition
+    setup = list(stencil_partition(0,1,iterations=1)[1])[:13]
+    body = list(stencil_body())*4
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = ScheduleCache(tmp)
+        results = []
+        for attempt in range(3):
+            c = VirtualCore(mem=[0.0]*8192)
+            c.execute(setup)
+            start = time.perf_counter()
+            r = cache.schedule(c,body)
+            elapsed = time.perf_counter() - start
+            results.append((r.cycles,c.inline_asm))
+            print('%s: %d cycles in %.1f ms' % ('hit ' if r.hit else 'miss',r.cycles,1000*elapsed))
+        c = VirtualCore(mem=[0.0]*8192)
+        c.execute(setup)
+        start = time.perf_counter()
+        r = cache.schedule(c,body,replay=False)
+        print('lookup only (%s) in %.1f ms' % ('hit' if r.hit else 'miss',1000*(time.perf_counter() - start)))
+        if len(set(results)) != 1:
+            raise Exception('Replayed schedule differs')
+        c = VirtualCore(mem=[0.0]*8192)
+        c.execute(setup)
+        if c.schedule(list(body)) != r.cycles:
+            raise Exception('Cached cycles differ from Core.schedule')
+        print(cache.info())
+        # A schedule cached without asm is not handed to a core that emits it
+        quiet = VirtualCore(mem=[0.0]*8192,emitter=NullEmitter())
+        quiet.execute(setup)
+        modes = ScheduleCache(os.path.join(tmp,'modes'))
+        modes.schedule(quiet,body)
+        c = VirtualCore(mem=[0.0]*8192)
+        c.execute(setup)
+        if modes.schedule(c,body,replay=False).inline_asm != r.inline_asm:
+            raise Exception('A schedule cached without asm was served to a core emitting it')
+        small = ScheduleCache(os.path.join(tmp,'small'),max_bytes=1)
+        for n in (50,60):
+            small.schedule(VirtualCore(timing_only=True),body[:n])
+        print('capped at one byte:',small.info())
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,347 @@
+import copy
+import heapq
+import itertools
+import random
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from simasm.ppc import PPC
+from simasm.emit import ListEmitter
+
+def inuse_latencies(instr,reg):
+    for (r,latencies) in instr.inuse_regs:
+        if r == reg:
+            return latencies
+    return (0,0)
+
+class DependenceGraph:
+    '''RAW/WAR/WAW dependences between the instructions of a stream.
+
+    Only the nearest conflicting instruction gets an edge, so the graph has
+    O(n) edges for typical kernels, but an instruction has no unissued
+    predecessor exactly when no earlier unissued instruction conflicts with
+    it.  Each edge carries the minimum issue distance the Core's hazard and
+    in-use rules impose between the two instructions.'''
+    def __init__(self,istream):
+        self.istream = istream
+        self.succs = [[] for instr in istream] # (successor, distance)
+        self.npreds = [0]*len(istream)
+        last_write = dict()
+        readers = dict()        # Readers since the last write
+        for i,instr in enumerate(istream):
+            instr_read = instr.read + instr.iread
+            instr_write = instr.write + instr.iwrite
+            preds = dict()
+            def depend(p,distance):
+                if p != i:
+                    preds[p] = max(preds.get(p,0),distance)
+            for reg in instr_read:
+                if reg in last_write:
+                    p = last_write[reg]
+                    if reg in istream[p].write: # Only FP registers have latencies
+                        depend(p,max(istream[p].latency,inuse_latencies(istream[p],reg)[0]))
+                    else:
+                        depend(p,0)
+            for reg in instr_write:
+                if reg in last_write:
+                    depend(last_write[reg],inuse_latencies(istream[last_write[reg]],reg)[1])
+                for p in readers.get(reg,()):
+                    depend(p,inuse_latencies(istream[p],reg)[1])
+            for (p,distance) in preds.items():
+                self.succs[p].append((i,distance))
+            self.npreds[i] = len(preds)
+            for reg in instr_read:
+                readers.setdefault(reg,[]).append(i)
+            for reg in instr_write:
+                last_write[reg] = i
+                readers[reg] = []
+    def __len__(self):
+        return len(self.istream)
+    def roots(self):
+        return [i for (i,n) in enumerate(self.npreds) if n == 0]
+    def heights(self,tail=True):
+        '''Length of the longest dependence chain starting at each
+        instruction, counting the latency of the last one unless tail is
+        False (then it bounds the cycles until the last issue)'''
+        heights = [0]*len(self.istream)
+        for i in reversed(range(len(self.istream))):
+            last = self.istream[i].latency if tail else 0
+            heights[i] = max([last] + [distance + heights[j] for (j,distance) in self.succs[i]])
+        return heights
+
+def safe_instructions(stream):
+    'Instructions (with their positions) that no earlier one in stream conflicts with'
+    stream_write = set() # Preserves order for read-after-write and write-after-write
+    stream_read  = set() # Preserves order for write-after-read
+    for i,instr in enumerate(stream):
+        instr_read = instr.read + instr.iread
+        instr_write = instr.write + instr.iwrite
+        if (stream_write.isdisjoint(instr_read) and stream_write.isdisjoint(instr_write)
+            and stream_read.isdisjoint(instr_write)):
+            yield i,instr
+        stream_write.update(instr_write)
+        stream_read.update(instr_read)
+
+def window_schedule(c,istream,window=32):
+    '''Issue instructions from any iterable, possibly unbounded, on core c,
+    choosing as Core.schedule_one does among the next window instructions.
+    Yields (instr, asm) as each one issues.  The asm is not accumulated in
+    c's emitter, so memory stays constant however long the stream is.
+    Larger windows find better schedules but cost more per instruction; a
+    window as long as the stream gives the order of Core.schedule.'''
+    if window < 1:
+        raise Exception('window must be positive')
+    return window_issue(c,iter(istream),window)
+
+def window_issue(c,istream,window):
+    'The generator behind window_schedule'
+    pending = list(itertools.islice(istream,window))
+    saved = c.emitter
+    lines = ListEmitter() if saved.enabled else saved
+    c.set_emitter(lines)
+    try:
+        while pending:
+            # The first pending instruction is always safe
+            (i,instr) = min(safe_instructions(pending), key=lambda cand:(c.fp_shortfall(cand[1]),c.cost(cand[1])))
+            c.execute_one(instr)
+            del pending[i]
+            pending.extend(itertools.islice(istream,1))
+            asm = lines.getvalue()
+            lines.clear()
+            yield instr, asm
+    finally:
+        c.set_emitter(saved)
+
+def list_schedule(c,istream,priority=None,dag=None):
+    '''Issue all of istream on core c, always choosing the ready instruction
+    that can issue soonest.  Ties go to the smallest priority[i] and then to
+    the earliest stream position, so the default reproduces the issue order
+    of Core.schedule_one.  Returns the issue order as stream indices.
+
+    The ready set is a heap keyed by earliest issue cycle.  Issuing an
+    instruction or advancing time can only delay the others, so stale keys
+    are lower bounds and are refreshed lazily when they reach the top.
+    Instructions that would run out of FP registers (Core.fp_shortfall) are
+    put off, in a list refreshed every issue since issuing may free some.'''
+    if dag is None:
+        dag = DependenceGraph(istream)
+    npreds = list(dag.npreds)
+    if priority is None:
+        priority = [0]*len(istream)
+    def key(i):
+        return (c.fp_shortfall(istream[i]), c.cycle + c.cost(istream[i]), priority[i], i)
+    ready = []
+    short = []                  # Keys of ready instructions short of registers
+    def push(k):
+        if k[0]:
+            short.append(k)
+        else:
+            heapq.heappush(ready,k)
+    for i in dag.roots():
+        push(key(i))
+    order = []
+    while ready or short:
+        if short:
+            pending = short[:]
+            del short[:]
+            for k in pending:
+                push(key(k[-1]))
+        if ready:
+            k = heapq.heappop(ready)
+            fresh = key(k[-1])
+            if fresh > k:
+                push(fresh)
+                continue
+        else:
+            k = min(short)
+            short.remove(k)
+        i = k[-1]
+        c.execute_one(istream[i])
+        order.append(i)
+        for (j,distance) in dag.succs[i]:
+            npreds[j] -= 1
+            if npreds[j] == 0:
+                push(key(j))
+    if len(order) < len(istream):
+        raise Exception('Cannot find a safe instruction')
+    return order
+
+# Tie-breaking heuristics for search, in addition to random ones
+VARIANTS = ('stream','critical-path','loads-first','reverse')
+
+def priorities(dag,variant,seed=0):
+    '''Priority of each instruction under a named heuristic, smallest first.
+    Ties left by a heuristic still go to the earliest stream position.'''
+    if variant == 'stream':
+        return [0]*len(dag)
+    elif variant == 'critical-path':
+        return [-h for h in dag.heights()]
+    elif variant == 'loads-first':
+        return [0 if instr.unit == PPC.LS else 1 for instr in dag.istream]
+    elif variant == 'reverse':
+        return [-i for i in range(len(dag))]
+    elif variant.startswith('random'):
+        rng = random.Random('%s:%s' % (seed,variant))
+        return [rng.random() for i in range(len(dag))]
+    else:
+        raise Exception('Unknown scheduling variant %r' % (variant,))
+
+SearchResult = namedtuple('SearchResult','cycles variant order inline_asm core')
+
+def schedule_variant(c,istream,variant,seed=0):
+    'Schedule istream on c (which is modified) using one tie-breaking variant'
+    cycle_start = c.cycle
+    asm_start = len(c.inline_asm)
+    dag = DependenceGraph(istream)
+    order = list_schedule(c,istream,priorities(dag,variant,seed),dag)
+    return SearchResult(c.cycle - cycle_start,variant,order,c.inline_asm[asm_start:],c)
+
+def search(c,istream,variants=8,seed=0,max_workers=None):
+    '''Schedule istream with several tie-breaking variants, each on its own
+    copy of c, spread over a process pool.  Returns the SearchResult with
+    the fewest cycles, the first variant winning ties, so the result only
+    depends on the seed.  The copies emit to a ListEmitter, whatever c
+    emits to (a StreamEmitter's file could not be copied), and the winning
+    asm is written to c's emitter; otherwise c is not modified, so replay
+    result.order or continue from result.core.'''
+    names = list(VARIANTS[:variants]) + ['random%d' % k for k in range(variants - len(VARIANTS))]
+    saved = c.emitter
+    c.set_emitter(ListEmitter() if saved.enabled else saved)
+    try:
+        if max_workers == 1:
+            results = [schedule_variant(copy.deepcopy(c),istream,name,seed) for name in names]
+        else:
+            with ProcessPoolExecutor(max_workers) as pool:
+                # Each task gets its own pickled copy of the core
+                futures = [pool.submit(schedule_variant,c,istream,name,seed) for name in names]
+                results = [f.result() for f in futures]
+    finally:
+        c.set_emitter(saved)
+    best = min(results,key=lambda r: r.cycles)
+    if best.inline_asm:
+        saved.write(best.inline_asm)
+    return best
+
+def beam_schedule(c,istream,width=8,dag=None):
+    '''Schedule istream on c by beam search: keep the width best partial
+    schedules, ranked by a lower bound on the total cycles, which is the
+    larger of the critical path through the remaining dependence graph and
+    the remaining work on each unit.  Partial schedules whose bound cannot
+    beat the best complete schedule (initially the greedy one) are pruned,
+    so the result is never worse than list_schedule.  Returns the issue
+    order, which has been executed on c.
+
+    On the stencil and the test kernels the critical-path list schedule is
+    already as good as the beam finds (151 cycles for stencil_body, against
+    238 greedy); the beam only improves on it, by a cycle or so, for short
+    kernels with tangled dependences (see benchmarks/beam.py).'''
+    if dag is None:
+        dag = DependenceGraph(istream)
+    tails = dag.heights(tail=False)
+    work = defaultdict(int)
+    longest = defaultdict(int)
+    for instr in istream:
+        work[instr.unit] += instr.ithroughput
+        longest[instr.unit] = max(longest[instr.unit],instr.ithroughput)
+    def bound(core,ready,work):
+        lb = core.cycle
+        for j in ready:
+            lb = max(lb,core.cycle + core.cost(istream[j]) + tails[j])
+        for (unit,cycles) in work.items():
+            if cycles > 0:
+                lb = max(lb,core.cycle + core.units.stall((unit,)) + cycles - longest[unit])
+        return lb
+    best = None
+    for priority in ([0]*len(istream),[-h for h in dag.heights()]):
+        greedy = c.fork()
+        order = list_schedule(greedy,istream,priority,dag)
+        if best is None or greedy.cycle < best:
+            best, best_order = greedy.cycle, order
+    # (bound, core, order, issued mask, npreds, ready, remaining work)
+    beam = [(None,c.fork(),[],0,list(dag.npreds),dag.roots(),dict(work))]
+    for step in range(len(istream)):
+        children = []
+        seen = set()
+        for (lb,core,order,mask,npreds,ready,work) in beam:
+            for i in ready:
+                child = core.fork()
+                child.execute_one(istream[i])
+                child_npreds = list(npreds)
+                child_ready = [j for j in ready if j != i]
+                for (j,distance) in dag.succs[i]:
+                    child_npreds[j] -= 1
+                    if child_npreds[j] == 0:
+                        child_ready.append(j)
+                child_work = dict(work)
+                child_work[istream[i].unit] -= istream[i].ithroughput
+                child_lb = bound(child,child_ready,child_work)
+                if child_lb >= best:
+                    continue
+                key = (mask | 1 << i,child.cycle,child.pipeline_state())
+                if key in seen:
+                    continue
+                seen.add(key)
+                children.append((child_lb,child,order+[i],mask | 1 << i,child_npreds,child_ready,child_work,-tails[i]))
+        if not children:
+            break
+        children.sort(key=lambda ch: (ch[0],ch[1].cycle,ch[7],ch[2]))
+        beam = [ch[:7] for ch in children[:width]]
+    else:
+        for (lb,core,order,mask,npreds,ready,work) in beam:
+            if core.cycle < best:
+                best, best_order = core.cycle, order
+    for i in best_order:
+        c.execute_one(istream[i])
+    return best_order
+
+def test():
+    import itertools
+    import os
+    import tempfile
+    from simasm.emit import StreamEmitter
+    from simasm.simulate import Dispatch, VirtualCore, get_core, stencil, stencil_body, test_kernels
+    from simasm.node import stencil_partition
+    def issue_order(c,code,use_dag):
+        'Instructions (their reprs) in the order Core.schedule issues them on c, and the cycle'
+        issued = []
+        execute_one = c.execute_one
+        def record(instr):
+            issued.append(instr)
+            execute_one(instr)
+        c.execute_one = record
+        c.schedule(list(code),use_dag)
+        return [repr(instr) for instr in issued], c.cycle
+    # list_schedule (use_dag) issues in the order of the greedy Core.schedule_one
+    kernels = [(kernel.__name__,get_core,kernel) for kernel in test_kernels]
+    kernels += [('stencil %d' % n,VirtualCore,lambda c,n=n: list(itertools.islice(stencil(),n))) for n in (72,300)]
+    for (name,cls,kernel) in kernels:
+        for (label,kwargs) in (('',dict),(' scoreboard',lambda: dict(use_scoreboard=True)),
+                               (' dispatch',lambda: dict(dispatch=Dispatch()))):
+            c = cls(timing_only=True,**kwargs())
+            greedy = issue_order(c,kernel(c),False)
+            c = cls(timing_only=True,**kwargs())
+            if issue_order(c,kernel(c),True) != greedy:
+                raise Exception('list_schedule order differs from Core.schedule on %s%s' % (name,label))
+        print('%s: list_schedule matches the greedy order, %d cycles' % (name,greedy[1]))
+    setup = list(stencil_partition(0,1,iterations=1)[1])[:13]
+    body = list(stencil_body())
+    # search copies the core, which cannot carry an open file
+    with tempfile.TemporaryDirectory() as tmp:
+        for max_workers in (1,2):
+            path = os.path.join(tmp,'search%d.s' % (max_workers,))
+            with StreamEmitter(path) as e:
+                c = VirtualCore(mem=[0.0]*8192,emitter=e)
+                c.execute(setup)
+                e.flush()
+                setup_asm = open(path).read()
+                cycle = c.cycle
+                result = search(c,body,variants=4,max_workers=max_workers)
+            if c.cycle != cycle:
+                raise Exception('search modified the core')
+            with open(path) as f:
+                if f.read() != setup_asm + result.inline_asm:
+                    raise Exception('search did not stream the winning asm')
+            print('search (max_workers=%d) on a StreamEmitter core: %s, %d cycles'
+                  % (max_workers,result.variant,result.cycles))
+
+if __name__ == '__main__':
+    test()
@@ -1,10 +1,15 @@
 #!/usr/bin/env python3
 
 from simasm import isa
-from simasm.ppc import Register, FPRegister, IntRegister, RegisterFile
-import itertools
-from collections import OrderedDict, deque, defaultdict
+from simasm.ppc import PPC, Register, FPRegister, IntRegister, RegisterFile
+import copy
+import operator
+from operator import attrgetter
+from collections import Counter, OrderedDict, namedtuple
 from simasm.view import CViewer
+from simasm.emit import ListEmitter
+from simasm.regalloc import Liveness
+from simasm.schedule import list_schedule, safe_instructions, window_schedule
 
 def dict_retire(d, cycles=1):
     for k,v in list(d.items()):
@@ -37,6 +42,67 @@ class Pipeline:
         return conflict
     def retire(self, cycles=1):
         dict_retire(self.dict, cycles)
+    def busy(self):
+        'Keys still in the pipeline'
+        return self.dict.keys()
+    def state(self):
+        'Remaining latencies, relative to the current cycle'
+        return frozenset(self.dict.items())
+    def copy(self):
+        p = Pipeline(self.name)
+        p.dict = self.dict.copy()
+        return p
+
+class Scoreboard:
+    '''Pipeline with the same interface, but storing the absolute cycle at
+    which each slot is ready in a flat list, so that retire is O(1) and
+    stall is a max over a few lookups.  Keys are mapped to slots by index;
+    by default they are the slots, as the register numbers Core uses.'''
+    def __init__(self,name,size,index=operator.index):
+        self.name = name
+        self.index = index
+        self.now = 0
+        self.ready = [0]*size
+        self.keys = [None]*size
+    def __getitem__(self,key):
+        if not self.has_key(key):
+            raise KeyError(key)
+        return self.ready[self.index(key)] - self.now
+    def __setitem__(self,key,val):
+        slot = self.index(key)
+        self.keys[slot] = key
+        self.ready[slot] = self.now + val
+    def has_key(self,key): return self.ready[self.index(key)] > self.now
+    def __repr__(self):
+        return 'Scoreboard(%s,%r)' % (self.name,', '.join('%s=%s' % (key,ready-self.now) for (key,ready) in zip(self.keys,self.ready) if ready > self.now))
+    def flush(self):
+        self.ready = [0]*len(self.ready)
+        self.now = 0
+    def stall(self, needed):
+        ready = self.now
+        for x in needed:
+            ready = max(ready, self.ready[self.index(x)])
+        return ready - self.now
+    def conflicts(self, needed):
+        conflict = OrderedDict()
+        for x in needed:
+            if self.has_key(x):
+                conflict[x] = self.ready[self.index(x)] - self.now
+        return conflict
+    def retire(self, cycles=1):
+        self.now += cycles
+    def busy(self):
+        'Slots still in the pipeline'
+        now = self.now
+        return set(slot for (slot,ready) in enumerate(self.ready) if ready > now)
+    def state(self):
+        'Remaining latencies, relative to the current cycle'
+        return frozenset((slot,ready-self.now) for (slot,ready) in enumerate(self.ready) if ready > self.now)
+    def copy(self):
+        s = copy.copy(self)
+        s.ready = list(self.ready)
+        s.keys = list(self.keys)
+        return s
 
 class WriteThrough:
     def __init__(self, maxtokens=6, latency=40):
@@ -53,6 +119,12 @@ class WriteThrough:
             return min(self.tokens.values())
     def retire(self, cycles=1):
         dict_retire(self.tokens, cycles)
+    def state(self):
+        return tuple(sorted(self.tokens.values()))
+    def copy(self):
+        w = copy.copy(self)
+        w.tokens = self.tokens.copy()
+        return w
     def issue(self, bytes=0):
         if self.stall(bytes):
             raise Exception('Cannot issue WriteThrough, stall=%d' % (self.stall(bytes)))
@@ -60,30 +132,106 @@ class WriteThrough:
             self.total_bytes += bytes
             self.tokens[self.total_bytes] = self.latency # total_bytes is just a unique key
 
+class Dispatch:
+    '''Instructions dispatched together in one cycle.  At most width
+    instructions dispatch per cycle, and a pair of them only if the units
+    appear together in pairs; with ordered, only in the order given there.
+    Pseudo-instructions (unit None) take no slot.  The default is the
+    PPC450: one FP and one non-FP instruction per cycle.'''
+    def __init__(self, width=2, pairs=((PPC.FP,PPC.LS),(PPC.FP,PPC.INT)), ordered=False):
+        self.width = width
+        self.pairs = set(pairs)
+        if not ordered:
+            self.pairs |= set((b,a) for (a,b) in pairs)
+        self.ordered = ordered
+        self.group = ()         # Units dispatched in the current cycle
+    def flush(self):
+        self.group = ()
+    def stall(self, unit):
+        if unit is None or not self.group:
+            return 0
+        if len(self.group) >= self.width:
+            return 1
+        for prev in self.group:
+            if (prev,unit) not in self.pairs:
+                return 1
+        return 0
+    def retire(self, cycles=1):
+        if cycles > 0:
+            self.group = ()
+    def state(self):
+        return self.group
+    def copy(self):
+        return copy.copy(self)  # group is an immutable tuple
+    def issue(self, unit):
+        if unit is not None:
+            self.group += (unit,)
+
+# An instruction with its physical registers resolved to their numbers, ready to issue
+Decoded = namedtuple('Decoded','instr run unit read write inuse latency ithroughput writethrough')
+
+LoopTiming = namedtuple('LoopTiming','cycles iterations warmup period cycles_per_iteration simulated')
+
+class Program(tuple):
+    'Pre-decoded instruction stream, see Core.compile'
+    def __repr__(self):
+        return 'Program(%r)' % ([d.instr for d in self],)
+
 class Core:
     memsize = 32                # Number of doubles
     fpregisters = 32
     intregisters = 32
-    inline_asm = ''
 
-    def __init__(self,cycle=0,fp=None,int=None,mem=None,use_trace=False, no_fma=False):
+    def __init__(self,cycle=0,fp=None,int=None,mem=None,use_trace=False, no_fma=False, use_scoreboard=False,
+                 timing_only=False, emitter=None, recorder=None, profiler=None, hierarchy=None, dispatch=None):
         self.no_fma = no_fma
+        self.timing_only = timing_only # Only model timing and register naming, never touch fp, int or mem
         self.cycle = cycle
-        self.counter = defaultdict(lambda:0)
-        self.fp = fp   if fp  is not None else RegisterFile(FPRegister,Core.fpregisters)
-        self.int = int if int is not None else RegisterFile(IntRegister,Core.intregisters)
-        self.mem = mem if mem is not None else [0.0]*Core.memsize
-        self.hazards = Pipeline('Register')
-        self.units = Pipeline('Logic Unit')
-        self.inuse_src = Pipeline('Registers unavailable as source (non-hazard)')
-        self.inuse_dst = Pipeline('Registers unavailable as destination (non-hazard)')
+        self.counter = Counter()
+        self.fp = fp   if fp  is not None else RegisterFile(FPRegister,self.fpregisters)
+        self.int = int if int is not None else RegisterFile(IntRegister,self.intregisters)
+        if getattr(mem,'ndim',None) == 1: # A NumPy array or memmap, indexed in place
+            from simasm.memory import ArrayMemory
+            mem = ArrayMemory(mem)
+        self.mem = mem if mem is not None else [0.0]*self.memsize
+        if use_scoreboard:
+            units = dict((unit,i) for (i,unit) in enumerate((None,PPC.FP,PPC.INT,PPC.LS)))
+            self.hazards = Scoreboard('Register',self.fpregisters)
+            self.units = Scoreboard('Logic Unit',len(units),units.__getitem__)
+            self.inuse_src = Scoreboard('Registers unavailable as source (non-hazard)',self.fpregisters)
+            self.inuse_dst = Scoreboard('Registers unavailable as destination (non-hazard)',self.fpregisters)
+        else:
+            self.hazards = Pipeline('Register')
+            self.units = Pipeline('Logic Unit')
+            self.inuse_src = Pipeline('Registers unavailable as source (non-hazard)')
+            self.inuse_dst = Pipeline('Registers unavailable as destination (non-hazard)')
         self.writethrough = WriteThrough()
+        self.dispatch = dispatch # A Dispatch limiting co-issue, None for any number per cycle
         self.regnames = dict()
         self.fppool = set(self.fp.keys())
         self.fpeternal = set()
-        self.trace = self.trace_print if use_trace else self.trace_none
+        self.liveness = None    # See plan_registers
+        if hierarchy is not None and timing_only:
+            raise Exception('A memory hierarchy needs the addresses, which timing_only does not compute')
+        self.hierarchy = hierarchy # A hierarchy.Hierarchy deciding load latencies
+        self.access = self.access_hierarchy if hierarchy is not None else self.access_none
+        self.access_latency = None
+        self.dead = []          # Names whose registers gc can reuse
+        self.intnames = dict()
+        self.intpool = set(self.int.keys())
+        self.recorder = recorder   # A trace.TraceRecorder, used instead of use_trace
+        if recorder is not None:
+            recorder.core = self
+            self.trace, self.trace_stall = recorder.issue, recorder.stall
+        else:
+            self.trace = self.trace_print if use_trace else self.trace_none
+            self.trace_stall = self.trace_stall_print
         self.use_trace = use_trace # storing this is a dirty hack, only used externally
+        self.profiler = profiler   # A profiler.Profiler, charging stalls to their causes
+        if profiler is not None:
+            profiler.core, profiler.start = self, cycle
         self.cv = CViewer(self)
+        self.set_emitter(emitter if emitter is not None else ListEmitter())
 
     def __str__(self):
         return ('Core(cycle=%r,\n\tfp=%s,\n\tint=%s,\n\tmem=%r,\n\tregnames=%s,\n\tcounter=%s)'
@@ -97,11 +245,42 @@ class Core:
         self.inuse_dst.flush()
         self.units.flush()
         self.writethrough.flush()
+        if self.dispatch is not None:
+            self.dispatch.flush()
     def name_registers(self,**args):
         self.regnames.update(args)
         self.fppool.difference_update(args.values())
+    def plan_registers(self,istream):
+        '''Reuse the registers of symbolic names whose values istream no
+        longer needs (see regalloc).  Names already allocated are left alone.
+        Programs from compile bind every register up front, so only
+        execute_one and the schedulers built on it reuse registers.  execute
+        needs as many registers as the stream order keeps values live (54
+        for stencil_body); the schedulers put off instructions that would
+        run out (see fp_shortfall).'''
+        self.liveness = Liveness(istream,pinned=set(self.regnames))
+        return self.liveness
     def gc(self):
-        raise Exception('Garbage collector not implemented')
+        'Return the registers of dead names to fppool'
+        for name in self.dead:
+            phys = self.regnames.pop(name,None)
+            if phys is not None and phys not in self.fpeternal:
+                self.fppool.add(phys)
+        self.dead = []
+    def reuse_cost(self,reg):
+        'Cycles until a write to reg could issue, so reuse adds no stall when possible'
+        num = (reg.num,)
+        return max(self.hazards.stall(num),self.inuse_src.stall(num),self.inuse_dst.stall(num))
+    def fp_shortfall(self,instr):
+        'Registers instr would allocate beyond those free or dead, so schedulers can put it off'
+        if len(self.fppool) >= 4: # More than any instruction names
+            return 0
+        new = set(reg for reg in instr.read + instr.write if isinstance(reg,str) and reg not in self.regnames)
+        if not new:
+            return 0
+        free = len(self.fppool) + len(set(self.regnames[name] for name in self.dead
+                                          if name in self.regnames) - self.fpeternal)
+        return max(0,len(new) - free)
     def get_fpregister(self,reg,allocate=True):
         if isinstance(reg,Register): # The register has been named explicitly
             self.fppool.discard(reg)
@@ -111,16 +290,47 @@ class Core:
             if phys is None:
                 if not allocate: 
                     raise Exception('Register "%s" has not been allocated' % (reg,))
-                if len(self.fppool) < 1:
+                if self.dead or len(self.fppool) < 1:
                     self.gc()
-                try:
-                    phys = self.fppool.pop()
-                except KeyError:
+                if len(self.fppool) < 1:
                     raise Exception('Cannot find a free register')
+                # Expired windows first, then the lowest number (deterministic, unlike set.pop())
+                busy = self.hazards.busy() | self.inuse_src.busy() | self.inuse_dst.busy()
+                expired = [r for r in self.fppool if r.num not in busy]
+                if expired:
+                    phys = min(expired,key=attrgetter('num'))
+                else:
+                    phys = min(self.fppool,key=lambda r:(self.reuse_cost(r),r.num))
+                self.fppool.remove(phys)
                 self.regnames[reg] = phys
             return phys
         else:
             raise Exception('Invalid register: %r' % reg)
+    def name_intregisters(self,**args):
+        self.intnames.update(args)
+        self.intpool.difference_update(args.values())
+    def get_intregister(self,reg):
+        if isinstance(reg,Register):
+            return reg
+        elif isinstance(reg,str): # Symbolic pointer, bound to a concrete register named after it
+            phys = self.intnames.get(reg)
+            if phys is None:
+                if len(self.intpool) < 1:
+                    raise Exception('Cannot find a free integer register')
+                phys = min(self.intpool,key=attrgetter('num'))
+                self.intpool.remove(phys)
+                phys = IntRegister(phys.num,c_var=reg)
+                self.intnames[reg] = phys
+            return phys
+        else:
+            raise Exception('Invalid register: %r' % reg)
+    def allocated_fpregisters(self,regs):
+        'Numbers of the physical registers for those of regs that have been allocated'
+        for reg in regs:
+            if isinstance(reg,Register):
+                yield reg.num
+            elif reg in self.regnames:
+                yield self.regnames[reg].num
     def access_fpregisters(self,*args):
         return (self.fp[self.get_fpregister(reg)] for reg in args)
     def acquire_fpregisters(self,numbers):
@@ -128,13 +338,15 @@ class Core:
         self.fpeternal.update(regs)
         self.fppool.difference_update(regs)
         return regs
-    def next_cycle(self):
-        self.cycle += 1
-        self.hazards.retire()
-        self.inuse_src.retire()
-        self.inuse_dst.retire()
-        self.units.retire()
-        self.writethrough.retire()
+    def next_cycle(self,cycles=1):
+        self.cycle += cycles
+        self.hazards.retire(cycles)
+        self.inuse_src.retire(cycles)
+        self.inuse_dst.retire(cycles)
+        self.units.retire(cycles)
+        self.writethrough.retire(cycles)
+        if self.dispatch is not None:
+            self.dispatch.retire(cycles)
     def trace_none(self,msg):
         pass
     def trace_print(self,msg):
@@ -142,161 +354,349 @@ class Core:
             print('[%2d] %s' % (self.cycle,msg))
         else:
             print('[%2d] -- %s' % (self.cycle,msg))
-    def print_inline(self,instr):
-        self.inline_asm += '%s\n' % self.cv.named_view(instr)
-    def execute_one(self,instr):
-        while self.units.stall((instr.unit,)) > 0:
-            self.trace('Instruction unit in use: %s' % (instr.unit,))
-            self.next_cycle()
-        while self.hazards.stall(map(self.get_fpregister,instr.read)) > 0:
-            def format_hazards(odict):
-                return ', '.join('(%s:%s,%d)' % (reg,self.get_fpregister(reg,allocate=False),cost) for (reg,cost) in odict.items())
-            self.trace('Register hazards: %s' % format_hazards(self.hazards.conflicts(instr.read)))
-            self.next_cycle()
-        while self.inuse_src.stall(map(self.get_fpregister,instr.read)) > 0:
-            def format_inuse_src(odict):
-                return ', '.join('(%s:%s,%d)' % (reg,self.get_fpregister(reg,allocate=False),cost) for (reg,cost) in odict.items())
-            self.trace('Register inuse_src: %s' % format_inuse_src(self.inuse_src.conflicts(instr.read)))
-            self.next_cycle()
-        while self.inuse_dst.stall(map(self.get_fpregister,instr.write)) > 0:
-            def format_inuse_dst(odict):
-                return ', '.join('(%s:%s,%d)' % (reg,self.get_fpregister(reg,allocate=False),cost) for (reg,cost) in odict.items())
-            self.trace('Register inuse_dst: %s' % format_inuse_dst(self.inuse_dst.conflicts(instr.read)))
-            self.next_cycle()
-        while self.writethrough.stall(instr.writethrough):
-            self.trace('WriteThrough tokens in use')
-            self.next_cycle()
-        self.trace(instr)
-        instr.run(self)
-        self.print_inline(instr)
-        self.counter[instr.unit] += 1
-        self.units[instr.unit] = instr.ithroughput
-        for reg in instr.write:
-            self.hazards[reg] = instr.latency
-        for reg,(src_latency,dst_latency) in instr.inuse_regs.items():
+    def trace_stall_print(self,d,stall,costs):
+        self.trace('Stall %d: %s' % (stall,self.format_stall(d.instr)))
+    def access_none(self,ea,store=False):
+        pass
+    def access_hierarchy(self,ea,store=False):
+        'Loads and stores report the address (in doubles) they compute'
+        if store:
+            self.hierarchy.store(8*ea)
+        else:
+            self.access_latency = self.hierarchy.load(8*ea)
+    def set_emitter(self,emitter):
+        'Send the inline asm of issued instructions to emitter (see simasm.emit)'
+        emitter.core = self
+        self.emitter = emitter
+        self.print_inline = self.print_inline_emit if emitter.enabled else self.print_inline_none
+    @property
+    def inline_asm(self):
+        return self.emitter.getvalue()
+    def print_inline_none(self,instr):
+        pass
+    def print_inline_emit(self,instr):
+        if instr.pragmatic:     # Not a real instruction, there is no asm for it
+            return
+        self.emitter.write('%s\n' % self.cv.named_view(instr))
+    def format_stall(self,instr):
+        'Every reason instr cannot issue in the current cycle'
+        def format_regs(pipeline,regs):
+            conflicts = []
+            for reg in regs:
+                phys = self.get_fpregister(reg,allocate=False)
+                cost = pipeline.stall((phys.num,))
+                if cost > 0:
+                    conflicts.append('(%s:%s,%d)' % (reg,phys,cost))
+            return ', '.join(conflicts)
+        reasons = []
+        if self.units.stall((instr.unit,)) > 0:
+            reasons.append('Instruction unit in use: %s (%d)' % (instr.unit,self.units.stall((instr.unit,))))
+        for (pipeline,kind,regs) in ((self.hazards,'hazards',instr.read),
+                                     (self.inuse_src,'inuse_src',instr.read),
+                                     (self.inuse_dst,'inuse_dst',instr.write)):
+            conflicts = format_regs(pipeline,regs)
+            if conflicts:
+                reasons.append('Register %s: %s' % (kind,conflicts))
+        if self.writethrough.stall(instr.writethrough):
+            reasons.append('WriteThrough tokens in use')
+        if self.dispatch is not None and self.dispatch.stall(instr.unit):
+            reasons.append('Dispatch group full')
+        return '; '.join(reasons)
+    def decode(self,instr):
+        'Resolve the registers of instr (to their numbers) and everything else issue needs'
+        read = tuple(self.get_fpregister(reg).num for reg in instr.read)
+        write = tuple(self.get_fpregister(reg).num for reg in instr.write)
+        inuse = tuple((self.get_fpregister(reg).num,src_latency,dst_latency)
+                      for reg,(src_latency,dst_latency) in instr.inuse_regs)
+        return Decoded(instr,instr.run,instr.unit,read,write,inuse,
+                       instr.latency,instr.ithroughput,instr.writethrough)
+    def bind(self,d):
+        '''d running a copy of its instruction with the register names
+        replaced by their registers, so run need not look them up'''
+        instr = d.instr
+        fpnames = set(reg for reg in instr.read + instr.write if isinstance(reg,str))
+        intnames = set(reg for reg in instr.iread + instr.iwrite if isinstance(reg,str))
+        if self.timing_only or not (fpnames or intnames):
+            return d
+        bound = copy.copy(instr)
+        for slot in instr.operands:
+            val = getattr(instr,slot)
+            if val in fpnames:
+                setattr(bound,slot,self.get_fpregister(val))
+            elif val in intnames:
+                setattr(bound,slot,self.get_intregister(val))
+        return d._replace(run=bound.run)
+    def compile(self,code):
+        '''Decode code once so that it can be executed repeatedly.  Registers
+        are bound to this core's current names, so the Program should only
+        be executed here.'''
+        return Program(self.bind(self.decode(instr)) for instr in code)
+    def issue(self,d):
+        # Nothing is issued while stalled, so every stall clears at the
+        # same time and we can jump straight to that cycle.
+        costs = (self.units.stall((d.unit,)),
+                 self.hazards.stall(d.read),
+                 self.inuse_src.stall(d.read),
+                 self.inuse_dst.stall(d.write),
+                 self.writethrough.stall(d.writethrough))
+        stall = max(costs)
+        if self.dispatch is not None:
+            stall = max(stall,self.dispatch.stall(d.unit))
+        if self.profiler is not None:
+            self.profiler.issue(self,d,stall)
+        if stall > 0:
+            if self.trace != self.trace_none:
+                self.trace_stall(d,stall,costs)
+            self.next_cycle(stall)
+        self.trace(d.instr)
+        latency = d.latency
+        if not self.timing_only:
+            self.access_latency = None # Not left over from an instruction that raised
+            d.run(self)
+            self.print_inline(d.instr)
+            if self.access_latency is not None: # Set by the hierarchy
+                latency = self.access_latency
+        self.counter[d.unit] += 1
+        self.units[d.unit] = d.ithroughput
+        for reg in d.write:
+            self.hazards[reg] = latency
+        for reg,src_latency,dst_latency in d.inuse:
             self.inuse_src[reg] = src_latency
             self.inuse_dst[reg] = dst_latency
-        self.writethrough.issue(instr.writethrough)
+        self.writethrough.issue(d.writethrough)
+        if self.dispatch is not None:
+            self.dispatch.issue(d.unit)
+    def execute_one(self,instr):
+        self.issue(self.decode(instr))
+        if self.liveness is not None:
+            self.dead.extend(self.liveness.issued(instr))
     def execute(self,code):
         cycle_start = self.cycle
-        for instr in code:
-            self.execute_one(instr)
+        if isinstance(code,Program):
+            for d in code:
+                self.issue(d)
+        else:
+            for instr in code:
+                self.execute_one(instr)
         return self.cycle - cycle_start
+    def fork(self):
+        '''Cheap copy of the timing state, for trying out schedules.  fp, int
+        and mem are shared, so the fork runs in timing_only mode.'''
+        c = copy.copy(self)
+        c.timing_only = True
+        c.trace = c.trace_none
+        c.profiler = None
+        c.cv = CViewer(c)
+        c.counter = Counter(self.counter)
+        c.hazards = self.hazards.copy()
+        c.units = self.units.copy()
+        c.inuse_src = self.inuse_src.copy()
+        c.inuse_dst = self.inuse_dst.copy()
+        c.writethrough = self.writethrough.copy()
+        if self.dispatch is not None:
+            c.dispatch = self.dispatch.copy()
+        c.regnames = dict(self.regnames)
+        c.fppool = set(self.fppool)
+        c.intnames = dict(self.intnames)
+        c.intpool = set(self.intpool)
+        c.dead = list(self.dead)
+        if self.liveness is not None:
+            c.liveness = self.liveness.copy()
+        return c
+    def pipeline_state(self):
+        'Everything that determines future timing, relative to the current cycle'
+        return (self.hazards.state(), self.units.state(), self.inuse_src.state(),
+                self.inuse_dst.state(), self.writethrough.state(),
+                self.dispatch.state() if self.dispatch is not None else None,
+                frozenset(self.regnames.items()))
+    def execute_loop(self,body,iterations):
+        '''Execute body iterations times.  Once the pipeline state at the
+        top of the loop repeats, the timing of the following iterations is
+        periodic, so whole periods are accounted in closed form (cycle and
+        counter) instead of being simulated; fp, int and mem only reflect
+        the simulated iterations.  With a memory hierarchy or a profiler
+        every iteration is simulated.  Returns a LoopTiming.'''
+        cycle_start = self.cycle
+        if not isinstance(body,Program):
+            body = self.compile(body)
+        seen = dict()
+        warmup = period = cycles_per_iteration = None
+        simulated = 0
+        i = 0
+        while i < iterations:
+            # Cache state is not part of pipeline_state, so a hierarchy rules out
+            # extrapolation, as does a profiler, which must see every stall
+            if period is None and self.hierarchy is None and self.profiler is None:
+                state = self.pipeline_state()
+                if state in seen:
+                    (warmup,cycle,counter) = seen[state]
+                    period = i - warmup
+                    delta = self.cycle - cycle
+                    cycles_per_iteration = delta / period
+                    periods = (iterations - i) // period
+                    self.cycle += periods * delta
+                    for (unit,count) in list(self.counter.items()):
+                        self.counter[unit] += periods * (count - counter.get(unit,0))
+                    i += periods * period
+                    continue
+                seen[state] = (i,self.cycle,dict(self.counter))
+            self.execute(body)
+            simulated += 1
+            i += 1
+        return LoopTiming(self.cycle - cycle_start,iterations,warmup,period,cycles_per_iteration,simulated)
     def cost(self,instr):
+        # Registers that have not been allocated yet cannot be in flight
         cost = max(self.units.stall((instr.unit,)),
-                   self.hazards.stall((self.get_fpregister(reg,allocate=False) for reg in instr.read)),
-                   self.inuse_src.stall((self.get_fpregister(reg,allocate=False) for reg in instr.read)),
-                   self.inuse_dst.stall((self.get_fpregister(reg,allocate=False) for reg in instr.write)),
+                   self.hazards.stall(self.allocated_fpregisters(instr.read)),
+                   self.inuse_src.stall(self.allocated_fpregisters(instr.read)),
+                   self.inuse_dst.stall(self.allocated_fpregisters(instr.write)),
                    self.writethrough.stall(instr.writethrough))
+        if self.dispatch is not None:
+            cost = max(cost,self.dispatch.stall(instr.unit))
         return cost
     def schedule_one(self,istream):
-        def get_candidates(stream):
-            'generator for safe instructions'
-            stream_write = set() # Preserves order for read-after-write
-            stream_read  = set() # Preserves order for write-after-read
-            for i,instr in enumerate(stream):
-                instr_read = instr.read.union(instr.iread)
-                instr_write = instr.write.union(instr.iwrite)
-                if stream_write.isdisjoint(instr_read) and stream_read.isdisjoint(instr_write):
-                    yield i,instr
-                stream_write.update(instr_write)
-                stream_read.update(instr_read)
-        candidates = list(get_candidates(istream))
+        candidates = list(safe_instructions(istream))
         if len(candidates) < 1:
             raise Exception('Cannot find a safe instruction')
-        (i,instr) = min(candidates, key=lambda c:self.cost(c[1]))
+        (i,instr) = min(candidates, key=lambda c:(self.fp_shortfall(c[1]),self.cost(c[1])))
         self.execute_one(instr)
         del istream[i]
-    def schedule(self,istream):
+    def schedule(self,istream,use_dag=False):
+        '''Issue istream in a greedy order, returning the number of cycles.
+        With use_dag, the dependence graph is built once and the ready set
+        kept in a heap (same order, O(n log n)), and istream is left intact.
+        Sequences other than lists (e.g. a streamfile.InstructionArray) are
+        copied into a list first, and also left intact.'''
         cycle_start = self.cycle
-        while len(istream) > 0:
-            self.schedule_one(istream)
+        if not isinstance(istream,list):
+            istream = list(istream)
+        if use_dag:
+            list_schedule(self,istream)
+        else:
+            while len(istream) > 0:
+                self.schedule_one(istream)
         return self.cycle - cycle_start
+    def schedule_stream(self,istream,window=32):
+        'Lazily schedule any iterable of instructions, see schedule.window_schedule'
+        return window_schedule(self,istream,window)
+
+class VirtualCore(Core):
+    'Enough FP registers for kernels such as stencil() that have not been register allocated'
+    fpregisters = 128
 
 def get_core(**kwargs):
     c = Core(**kwargs)
     c.mem[:32] = map(float,range(32))
     return c
 
+def merge(*streams):
+    istreams = [iter(s) for s in streams]
+    result = []
+    while len(istreams) > 0:
+        try:
+            s = istreams.pop(0)
+            result.append(next(s))
+            istreams.append(s)
+        except StopIteration:
+            pass
+    return result
+
+def s_weights(w01,w2x):
+    return [isa.fpset2(w01,1/9,2/9), isa.fpset2(w2x,1/9,-1)]
+def s_preamble(a,i0):
+    yield isa.lfpd(a,i0,0)  # A[0],A[1]
+    yield isa.lfdu(a,i0,16) # A[2],A[1]
+
+def kernel_test1(c):
+    (r21,s21,w01,w2x,a21,b21,a23,b23) = c.acquire_fpregisters(range(8))
+    (i0,i1,ir0,is0,sixteen) = map(IntRegister,range(5))
+    return (s_weights(w01,w2x)
+            + merge(s_preamble(a21,i0),s_preamble(b21,i1))
+            + [
+        isa.fxcpmadd(r21,w01,a21,r21),
+        isa.fxcpmadd(s21,w01,b21,s21),
+        isa.lfpd(a23,i0,16),
+        isa.lfpd(b23,i1,16),
+        isa.fxcxma(r21,w01,a23,r21),
+        isa.fxcxma(s21,w01,b23,s21),
+        isa.lfdu(a23,i0,16), # Rename to a43
+        isa.lfdu(b23,i1,16), # Rename to a43
+
+        isa.intset(ir0,8*8),
+        isa.intset(is0,18*8),
+        isa.intset(sixteen,16),
+        isa.stfxdux(r21,ir0,sixteen),
+        isa.stfxdux(s21,is0,sixteen),
+        ])
+
+def kernel_alloc(c):
+    (r21,s21,w01,w2x) = c.acquire_fpregisters(range(4))
+    (i0,i1,ir0,is0,sixteen) = map(IntRegister,range(5))
+    c.name_registers(a21=FPRegister(4),b21=FPRegister(5))
+    return [
+        # weights
+        isa.fpset2(w01,1/9,2/9),
+        isa.fpset2(w2x,1/9,-1),
+        # preamble
+        isa.lfpd('a21',i0,0),  # A[0],A[1]
+        isa.lfdu('a21',i0,16), # A[2],A[1]
+        isa.lfpd('b21',i1,0),  # A[0],A[1]
+        isa.lfdu('b21',i1,16), # A[2],A[1]
+        # start loads
+        isa.fxcpmadd(r21,w01,'a21',r21),
+        isa.fxcpmadd(s21,w01,'b21',s21),
+        isa.lfpd('a23',i0,16),
+        isa.lfpd('b23',i1,16),
+        isa.fxcxma(r21,w01,'a23',r21),
+        isa.fxcxma(s21,w01,'b23',s21),
+        isa.lfdu('a23',i0,16), # a43
+        isa.lfdu('b23',i1,16), # b43
+
+        isa.intset(ir0,8*8),
+        isa.intset(is0,18*8),
+        isa.intset(sixteen,16),
+        isa.stfxdux(r21,ir0,sixteen),
+        isa.stfxdux(s21,is0,sixteen),
+        ]
+
+# Kernels set up by tests(), each taking the core they will run on
+test_kernels = (kernel_test1, kernel_alloc)
+
 def tests():
-    def merge(*streams):
-        istreams = [iter(s) for s in streams]
-        result = []
-        while len(istreams) > 0:
-            try:
-                s = istreams.pop(0)
-                result.append(next(s))
-                istreams.append(s)
-            except StopIteration:
-                pass
-        return result
-    def s_weights(w01,w2x):
-        return [isa.fpset2(w01,1/9,2/9), isa.fpset2(w2x,1/9,-1)]
-    def s_preamble(a,i0):
-        yield isa.lfpd(a,i0,0)  # A[0],A[1]
-        yield isa.lfdu(a,i0,16) # A[2],A[1]
-    def test1():
+    for kernel in test_kernels:
         c = get_core()
-        (r21,s21,w01,w2x,a21,b21,a23,b23) = c.acquire_fpregisters(range(8))
-        (i0,i1,ir0,is0,sixteen) = map(IntRegister,range(5))
-        istream = (s_weights(w01,w2x)
-                   + merge(s_preamble(a21,i0),s_preamble(b21,i1))
-                   + [
-                isa.fxcpmadd(r21,w01,a21,r21),
-                isa.fxcpmadd(s21,w01,b21,s21),
-                isa.lfpd(a23,i0,16),
-                isa.lfpd(b23,i1,16),
-                isa.fxcxma(r21,w01,a23,r21),
-                isa.fxcxma(s21,w01,b23,s21),
-                isa.lfdu(a23,i0,16), # Rename to a43
-                isa.lfdu(b23,i1,16), # Rename to a43
-
-                isa.intset(ir0,8*8),
-                isa.intset(is0,18*8),
-                isa.intset(sixteen,16),
-                isa.stfxdux(r21,ir0,sixteen),
-                isa.stfxdux(s21,is0,sixteen),
-                ])
+        istream = kernel(c)
         #for instr in istream: print(instr); #c.trace = c.trace_none
         c.schedule(istream)
         c.execute([isa.inspect()])
-    def test_alloc():
-        c = get_core()
-        (r21,s21,w01,w2x) = c.acquire_fpregisters(range(4))
-        (i0,i1,ir0,is0,sixteen) = map(IntRegister,range(5))
-        c.name_registers(a21=FPRegister(4),b21=FPRegister(5))
-        istream = [
-            # weights
-            isa.fpset2(w01,1/9,2/9),
-            isa.fpset2(w2x,1/9,-1),
-            # preamble
-            isa.lfpd('a21',i0,0),  # A[0],A[1]
-            isa.lfdu('a21',i0,16), # A[2],A[1]
-            isa.lfpd('b21',i1,0),  # A[0],A[1]
-            isa.lfdu('b21',i1,16), # A[2],A[1]
-            # start loads
-            isa.fxcpmadd(r21,w01,'a21',r21),
-            isa.fxcpmadd(s21,w01,'b21',s21),
-            isa.lfpd('a23',i0,16),
-            isa.lfpd('b23',i1,16),
-            isa.fxcxma(r21,w01,'a23',r21),
-            isa.fxcxma(s21,w01,'b23',s21),
-            isa.lfdu('a23',i0,16), # a43
-            isa.lfdu('b23',i1,16), # b43
+    test_dispatch()
 
-            isa.intset(ir0,8*8),
-            isa.intset(is0,18*8),
-            isa.intset(sixteen,16),
-            isa.stfxdux(r21,ir0,sixteen),
-            isa.stfxdux(s21,is0,sixteen),
-            ]
-        #for instr in istream: print(instr); #c.trace = c.trace_none
-        c.schedule(istream)
-        c.execute([isa.inspect()])
-    test1()
-    test_alloc()
+def test_dispatch(n=300):
+    '''Pairing an FP with a non-FP instruction saves cycles over single
+    issue, while a Dispatch that constrains nothing the units do not
+    already constrain changes no timing'''
+    import itertools
+    units = (PPC.FP,PPC.LS,PPC.INT)
+    code = list(itertools.islice(stencil(),n))
+    fponly = [instr for instr in code if instr.unit == PPC.FP]
+    def cycles(code,dispatch,scheduled):
+        c = VirtualCore(timing_only=True,dispatch=dispatch)
+        return c.schedule(list(code)) if scheduled else c.execute(code)
+    for scheduled in (False,True):
+        label = 'scheduled' if scheduled else 'in order'
+        free = cycles(code,None,scheduled)
+        paired = cycles(code,Dispatch(),scheduled)
+        single = cycles(code,Dispatch(width=1),scheduled)
+        if not free <= paired < single:
+            raise Exception('Dispatch %s: %d free, %d paired, %d single issue' % (label,free,paired,single))
+        if cycles(code,Dispatch(width=len(units),pairs=itertools.product(units,units)),scheduled) != free:
+            raise Exception('Unconstrained Dispatch changed the cycles %s' % (label,))
+        if cycles(fponly,Dispatch(width=1),scheduled) != cycles(fponly,None,scheduled):
+            raise Exception('Single issue changed the cycles of FP instructions alone %s' % (label,))
+        print('stencil %s: %d cycles single issue, %d paired, %d without a Dispatch' % (label,single,paired,free))
 
-def stencil():
+def stencil_body():
+    'One iteration of the stencil loop, the nine load streams interleaved with the FMAs'
     def label(c,i,j,kp,ks):
         return '%s_%d_%d_%d%d' % (c,i,j,kp,ks)
     def stream(i,j):
@@ -321,12 +721,15 @@ def stencil():
         for j in (0,1,2):
             instrs.append(stream(i,j))
     instrs.append(jam(1,1))
+    return merge(*instrs)
+
+def stencil():
     yield isa.fpset2('w01',1/9,2/9)
     yield isa.fpset2('w2x',1/9,9)
     while True:
-        for ins in instrs:
-            yield next(ins)
-   
+        for instr in stencil_body():
+            yield instr
+
 def main():
     tests()
     # for instr in itertools.islice(stencil(),10):
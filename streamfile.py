@@ -0,0 +1,186 @@
+'''Instruction streams saved as a binary struct of arrays
+
+    save('stencil.sim',code)
+    code = load('stencil.sim')  # An InstructionArray over a memmap
+    c.execute(code)
+
+Each instruction is one fixed-size record: its opcode (an index into the
+table of isa class names) and its Instruction.operands, each tagged as a
+name (an index into the table of symbolic register names), an integer, a
+float (its bits) or an explicit register (its number; an IntRegister's C
+variable, as one more than its name id, goes in the upper 32 bits).  The
+records come first so that load can memory-map them; the tables follow
+as JSON, found through the offset in the file header.  save takes any
+iterable, writing the records in chunks, so a schedule is saved by saving
+its instructions in issue order.'''
+import json
+import struct
+import numpy as np
+from simasm import isa
+from simasm.ppc import FPRegister, IntRegister
+
+MAGIC = b'SIMASM\x00\x01'
+HEADER = struct.Struct('<8sQ')  # Magic, offset of the tables
+OPERANDS = 4                    # Most operands of any instruction
+NONE, NAME, INT, FLOAT, FPREG, INTREG = range(6)
+
+record_dtype = np.dtype([('op','<u2'),
+                         ('tags','u1',(OPERANDS,)),
+                         ('args','<i8',(OPERANDS,))])
+
+def opcode_class(name):
+    cls = getattr(isa,name,None)
+    if not (isinstance(cls,type) and issubclass(cls,isa.Instruction)):
+        raise Exception('Unknown opcode %r' % (name,))
+    return cls
+
+def save(path,code,chunk=1<<16):
+    '''Write the instructions of code to path, returning how many.  Operands
+    must be register names, registers, integers or floats.'''
+    opcodes = dict()            # Class name -> opcode
+    names = dict()              # Register name -> id
+    ops, tags, args = [], [], []
+    count = 0
+    def flush():
+        buf = np.zeros(len(ops),dtype=record_dtype)
+        buf['op'] = ops
+        buf['tags'] = tags
+        buf['args'] = args
+        f.write(buf.tobytes())
+        del ops[:], tags[:], args[:]
+    with open(path,'wb') as f:
+        f.write(HEADER.pack(MAGIC,0))
+        for instr in code:
+            ops.append(opcodes.setdefault(type(instr).__name__,len(opcodes)))
+            rtags, rargs = [NONE]*OPERANDS, [0]*OPERANDS
+            for (k,slot) in enumerate(instr.operands):
+                val = getattr(instr,slot)
+                if isinstance(val,str):
+                    rtags[k], rargs[k] = NAME, names.setdefault(val,len(names))
+                elif isinstance(val,int) and not isinstance(val,bool):
+                    rtags[k], rargs[k] = INT, val
+                elif isinstance(val,float):
+                    rtags[k], rargs[k] = FLOAT, struct.unpack('<q',struct.pack('<d',val))[0]
+                elif type(val) is FPRegister:
+                    rtags[k], rargs[k] = FPREG, val.num
+                elif type(val) is IntRegister:
+                    var = names.setdefault(val.c_var,len(names)) + 1 if val.c_var else 0
+                    rtags[k], rargs[k] = INTREG, var << 32 | val.num
+                else:
+                    raise Exception('Cannot save operand %s=%r of %r' % (slot,val,instr))
+            tags.append(rtags)
+            args.append(rargs)
+            count += 1
+            if len(ops) == chunk:
+                flush()
+        flush()
+        tables = f.tell()
+        f.write(json.dumps(dict(opcodes=sorted(opcodes,key=opcodes.get),
+                                names=sorted(names,key=names.get))).encode())
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC,tables))
+    return count
+
+def load(path):
+    'The InstructionArray saved at path, its records memory-mapped'
+    with open(path,'rb') as f:
+        (magic,tables) = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC:
+            raise Exception('%s is not an instruction stream' % (path,))
+        f.seek(tables)
+        meta = json.loads(f.read().decode())
+    count = (tables - HEADER.size) // record_dtype.itemsize
+    if count:
+        records = np.memmap(path,dtype=record_dtype,mode='r',offset=HEADER.size,shape=(count,))
+    else:
+        records = np.zeros(0,dtype=record_dtype)
+    return InstructionArray(records,[opcode_class(name) for name in meta['opcodes']],meta['names'])
+
+class InstructionArray:
+    '''A read-only sequence of instructions over an array of records.
+    Instructions are only built when indexed or iterated, each time anew;
+    slices are InstructionArrays sharing the records.'''
+    def __init__(self,records,classes,names):
+        self.records = records
+        self.classes = classes  # Opcode -> isa class
+        self.names = names      # Name id -> register name
+    def __len__(self):
+        return len(self.records)
+    def __repr__(self):
+        return 'InstructionArray(<%d instructions>)' % (len(self),)
+    def instruction(self,op,tags,args):
+        cls = self.classes[op]
+        operands = []
+        for (tag,arg) in zip(tags[:len(cls.operands)],args):
+            if tag == NAME:
+                operands.append(self.names[arg])
+            elif tag == INT:
+                operands.append(arg)
+            elif tag == FLOAT:
+                operands.append(struct.unpack('<d',struct.pack('<q',arg))[0])
+            elif tag == FPREG:
+                operands.append(FPRegister(arg))
+            else:
+                var = arg >> 32
+                operands.append(IntRegister(arg & 0xffffffff,self.names[var - 1] if var else ''))
+        return cls(*operands)
+    def __getitem__(self,i):
+        if isinstance(i,slice):
+            return InstructionArray(self.records[i],self.classes,self.names)
+        rec = self.records[i]
+        return self.instruction(int(rec['op']),rec['tags'].tolist(),rec['args'].tolist())
+    def __iter__(self):
+        for start in range(0,len(self.records),1024):
+            block = self.records[start:start+1024]
+            for (op,tags,args) in zip(block['op'].tolist(),block['tags'].tolist(),block['args'].tolist()):
+                yield self.instruction(op,tags,args)
+    def opcodes(self):
+        'Count of each opcode, straight from the records'
+        counts = np.bincount(self.records['op'],minlength=len(self.classes))
+        return dict((cls.__name__,int(n)) for (cls,n) in zip(self.classes,counts))
+
+def test(n=10**6):
+    import itertools
+    import os
+    import tempfile
+    import time
+    from simasm.simulate import VirtualCore, get_core, stencil, test_kernels
+    from simasm.node import stencil_partition
+    def fingerprint(code):
+        'repr, plus the C variables repr leaves out'
+        return [(repr(instr),[getattr(instr,slot).c_var for slot in instr.operands
+                              if isinstance(getattr(instr,slot),IntRegister)]) for instr in code]
+    code = list(stencil_partition(0,1,iterations=2)[1]) + [isa.fpset2('x',-0.1,float('inf')),isa.nop()]
+    kernels = [kernel(get_core()) for kernel in test_kernels]
+    kernels.append([isa.lfpdx('a',IntRegister(3,'p'),IntRegister(4))])
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp,'code.sim')
+        for kernel in [code] + kernels:
+            save(path,kernel)
+            loaded = load(path)
+            if fingerprint(loaded) != fingerprint(kernel):
+                raise Exception('Round trip changed the instructions')
+            print('%d instructions round trip, %s' % (len(loaded),loaded.opcodes()))
+            del loaded
+        save(path,code)
+        loaded = load(path)
+        for use_dag in (False,True):
+            (c,d) = (VirtualCore(timing_only=True),VirtualCore(timing_only=True))
+            print('schedule%s: %d cycles from the list, %d from the file'
+                  % (' (dag)' if use_dag else '',c.schedule(list(code),use_dag),d.schedule(loaded,use_dag)))
+        big = os.path.join(tmp,'big.sim')
+        start = time.perf_counter()
+        save(big,itertools.islice(stencil(),n))
+        saved = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded = load(big)
+        opened = time.perf_counter() - start
+        print('%d instructions: saved in %.2fs (%d bytes), opened in %.4fs'
+              % (len(loaded),saved,os.path.getsize(big),opened))
+        start = time.perf_counter()
+        cycles = VirtualCore(timing_only=True).execute(loaded[:100000])
+        print('first 100000 executed from the file in %.2fs, %d cycles' % (time.perf_counter() - start,cycles))
+        del loaded
+
+if __name__ == '__main__':
+    test()
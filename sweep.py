@@ -0,0 +1,192 @@
+'''Cycles of a kernel over a grid of timing parameters
+
+    cycles = sweep(code,dict(load_latency=range(2,9),fp_latency=range(3,8)))
+
+The timing constants of isa (and of the WriteThrough tokens) are baked
+into each instruction when it is constructed; here the instructions of a
+kind ('fp', 'load' or 'store', see Instruction.kind) take theirs from the
+grid instead.  The fixed issue order is evaluated for every grid point at
+once: issuing in order, each instruction waits for the latest of its
+unit, hazards, in-use registers and tokens, which is a max-plus recurrence
+over arrays holding one value per point.  With reschedule, every point is
+instead scheduled by Core.schedule on instructions retimed to its values,
+spread over a process pool.  Either way the pipeline starts out empty.'''
+import copy
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from simasm import isa
+from simasm.simulate import VirtualCore, WriteThrough
+
+PARAMETERS = ('load_latency','store_latency','fp_latency','store_cycles',
+              'fpreg_load_source_latency','fpreg_load_dest_latency',
+              'fpreg_store_source_latency','fpreg_store_dest_latency',
+              'maxtokens','writethrough_latency')
+
+def defaults():
+    'Current value of every parameter'
+    wt = WriteThrough()
+    p = dict((name,getattr(isa,name)) for name in PARAMETERS[:-2])
+    p.update(maxtokens=wt.maxtokens,writethrough_latency=wt.latency)
+    return p
+
+def timing(instr,p):
+    '''Latency, issue throughput and in-use (source, destination) latencies
+    of instr under parameters p, which may be scalars or arrays.  In-use is
+    None for instructions that keep their own.'''
+    kind = instr.kind
+    if kind == 'fp':
+        return p['fp_latency'], instr.ithroughput, None
+    elif kind == 'load':
+        return p['load_latency'], instr.ithroughput, (p['fpreg_load_source_latency'],p['fpreg_load_dest_latency'])
+    elif kind == 'store':
+        return p['store_latency'], p['store_cycles'], (p['fpreg_store_source_latency'],p['fpreg_store_dest_latency'])
+    return instr.latency, instr.ithroughput, None
+
+def retime(instr,p):
+    'A copy of instr with the timing of scalar parameters p'
+    instr = copy.copy(instr)
+    instr.latency, instr.ithroughput, inuse = timing(instr,p)
+    if inuse is not None:
+        instr.inuse_regs = tuple((reg,inuse) for (reg,latencies) in instr.inuse_regs)
+    return instr
+
+def fresh_core(core):
+    'A timing-only copy of core (or a new VirtualCore) with an empty pipeline'
+    if core is None:
+        return VirtualCore(timing_only=True)
+    if core.dispatch is not None or core.hierarchy is not None:
+        raise Exception('sweep does not model Dispatch or a memory hierarchy')
+    c = core.fork()
+    c.flush_pipeline()
+    return c
+
+def evaluate(program,p,npoints):
+    '''Cycles to issue program (decoded, see Core.compile) in order at
+    npoints points, p holding an array or a scalar for each parameter'''
+    now = np.zeros(npoints,dtype=np.int64)
+    units = dict()              # Cycle each unit is free again
+    ready = dict()              # Cycle each register's value is ready
+    src_free = dict()           # Cycles each register can be a source, destination
+    dst_free = dict()
+    maxtokens = np.broadcast_to(p['maxtokens'],(npoints,))
+    if maxtokens.min() < 1:
+        raise Exception('Need at least one WriteThrough token')
+    expires = np.empty((sum(1 for d in program if d.writethrough),npoints),dtype=np.int64)
+    stores = 0                  # expires holds the cycle each store's token expires
+    points = np.arange(npoints)
+    for d in program:
+        latency, ithroughput, inuse = timing(d.instr,p)
+        if d.unit in units:
+            np.maximum(now,units[d.unit],out=now)
+        for reg in d.read:
+            if reg in ready:
+                np.maximum(now,ready[reg],out=now)
+            if reg in src_free:
+                np.maximum(now,src_free[reg],out=now)
+        for reg in d.write:
+            if reg in dst_free:
+                np.maximum(now,dst_free[reg],out=now)
+        if d.writethrough:
+            # Tokens expire in issue order, so with m tokens the store waits
+            # for the one taken m stores ago
+            oldest = stores - maxtokens
+            if oldest.max() >= 0:
+                waits = expires[np.maximum(oldest,0),points]
+                np.maximum(now,np.where(oldest >= 0,waits,0),out=now)
+            expires[stores] = now + p['writethrough_latency']
+            stores += 1
+        units[d.unit] = now + ithroughput
+        for reg in d.write:
+            ready[reg] = now + latency
+        for (reg,src_latency,dst_latency) in d.inuse:
+            if inuse is not None:
+                (src_latency,dst_latency) = inuse
+            src_free[reg] = now + src_latency
+            dst_free[reg] = now + dst_latency
+    return now
+
+def reschedule_points(core,code,points):
+    'Cycles of Core.schedule at each of points, a list of parameter dicts'
+    cycles = []
+    for p in points:
+        c = fresh_core(core)
+        c.writethrough = WriteThrough(p['maxtokens'],p['writethrough_latency'])
+        cycles.append(c.schedule([retime(instr,p) for instr in code]))
+    return cycles
+
+def sweep(code,grid,core=None,reschedule=False,max_workers=None,chunk=None):
+    '''Cycles of code at every point of grid, a dict from parameter name to
+    the values to try.  Returns an integer array with one axis per grid
+    entry, in order; parameters not in grid keep their defaults.  Registers
+    are named as on core (by default a fresh VirtualCore), which is not
+    modified.  The fixed order is evaluated in chunks of points, in this
+    process unless max_workers is given.  Rescheduling is much slower per
+    point, so it goes over a process pool unless max_workers is 1.'''
+    for name in grid:
+        if name not in PARAMETERS:
+            raise Exception('Unknown timing parameter %r' % (name,))
+    code = list(code)
+    axes = [np.asarray(values,dtype=np.int64) for values in grid.values()]
+    shape = tuple(len(a) for a in axes)
+    columns = [a.ravel() for a in np.meshgrid(*axes,indexing='ij')]
+    npoints = int(np.prod(shape))
+    base = defaults()
+    def params(start,stop):
+        p = dict(base)
+        p.update((name,column[start:stop]) for (name,column) in zip(grid,columns))
+        return p
+    if reschedule:
+        def point(i):
+            p = dict(base)
+            p.update((name,int(column[i])) for (name,column) in zip(grid,columns))
+            return p
+        chunk = chunk or 16
+        tasks = [[point(i) for i in range(start,min(start+chunk,npoints))] for start in range(0,npoints,chunk)]
+        if max_workers == 1:
+            results = [reschedule_points(core,code,points) for points in tasks]
+        else:
+            with ProcessPoolExecutor(max_workers) as pool:
+                results = list(pool.map(reschedule_points,itertools.repeat(core),itertools.repeat(code),tasks))
+        return np.array(list(itertools.chain.from_iterable(results)),dtype=np.int64).reshape(shape)
+    program = fresh_core(core).compile(code)
+    chunk = chunk or 1 << 16
+    bounds = [(start,min(start+chunk,npoints)) for start in range(0,npoints,chunk)]
+    if max_workers in (None,1):
+        results = [evaluate(program,params(start,stop),stop-start) for (start,stop) in bounds]
+    else:
+        with ProcessPoolExecutor(max_workers) as pool:
+            results = list(pool.map(evaluate,itertools.repeat(program),
+                                    [params(start,stop) for (start,stop) in bounds],
+                                    [stop-start for (start,stop) in bounds]))
+    return np.concatenate(results).reshape(shape)
+
+def test():
+    import time
+    from simasm.node import stencil_partition
+    code = list(stencil_partition(0,1,iterations=7)[1]) # Storing the accumulators every iteration
+    grid = dict(load_latency=range(2,12),fp_latency=range(3,13),maxtokens=range(2,12),writethrough_latency=range(10,110,10))
+    start = time.perf_counter()
+    cycles = sweep(code,grid)
+    print('%d points of %d instructions in %.2fs, cycles %d to %d'
+          % (cycles.size,len(code),time.perf_counter() - start,cycles.min(),cycles.max()))
+    # Every point agrees with executing retimed instructions on a core
+    rng = np.random.RandomState(0)
+    for k in range(20):
+        index = tuple(rng.randint(n) for n in cycles.shape)
+        p = defaults()
+        p.update((name,list(values)[i]) for ((name,values),i) in zip(grid.items(),index))
+        c = VirtualCore(timing_only=True)
+        c.writethrough = WriteThrough(p['maxtokens'],p['writethrough_latency'])
+        if c.execute([retime(instr,p) for instr in code]) != cycles[index]:
+            raise Exception('sweep disagrees with Core.execute at %r' % (p,))
+    print('load_latency x fp_latency at the default tokens, in order:')
+    small = dict(load_latency=range(2,9),fp_latency=range(3,8))
+    print(sweep(code,small))
+    start = time.perf_counter()
+    cycles = sweep(code[:13+147],small,reschedule=True)
+    print('one iteration rescheduled at each point (%.2fs):' % (time.perf_counter() - start,))
+    print(cycles)
+
+if __name__ == '__main__':
+    test()
@@ -0,0 +1,162 @@
+'''Binary trace of issues and stalls, kept in a NumPy structured array
+
+    r = TraceRecorder()
+    c = Core(recorder=r)        # One recorder per core
+    ...
+    r.save('trace.npy')
+    print(''.join(render(np.load('trace.npy'))))
+
+Each stall produces one record per reason (the unit, each register with
+a hazard or in-use conflict, the WriteThrough tokens, a full dispatch
+group), stall holding the cycles that reason alone would cost.'''
+import itertools
+import numpy as np
+from simasm.ppc import PPC, FPRegister
+
+ISSUE, UNIT, RAW, INUSE_SRC, INUSE_DST, WRITETHROUGH, DISPATCH = range(7)
+KINDS = ('issue','unit','hazards','inuse_src','inuse_dst','writethrough','dispatch')
+UNITS = (None,PPC.FP,PPC.INT,PPC.LS)
+UNIT_CODES = dict((unit,i) for (i,unit) in enumerate(UNITS))
+
+record_dtype = np.dtype([('cycle','i8'),      # Cycle of the issue, or at which the stall started
+                         ('kind','u1'),
+                         ('instr','i8'),      # Sequence number of the instruction issued, or stalled
+                         ('unit','u1'),       # Index in UNITS
+                         ('reg','i2'),        # FP register number, -1 if none
+                         ('stall','i4')])
+
+class TraceRecorder:
+    '''Appends records to a preallocated array, doubling it when full, or
+    with ring=True overwriting the oldest so memory stays fixed.  Records
+    are staged as a plain list of tuples and converted a chunk at a time,
+    which is much cheaper than assigning numpy records one by one.  The
+    instructions themselves are kept alongside for render.'''
+    def __init__(self,capacity=1<<16,ring=False,chunk=1024):
+        self.buffer = np.zeros(capacity,dtype=record_dtype)
+        self.instructions = [None]*capacity
+        self.ring = ring
+        self.chunk = chunk
+        self.count = 0          # Records ever copied to buffer
+        self.core = None        # Set by the Core recording to it
+        self.issued = 0
+        self.pending = []
+        self.pending_instructions = []
+    def __len__(self):
+        self.flush()
+        return min(self.count,len(self.buffer))
+    def append(self,cycle,kind,instr,unit,reg=-1,stall=0):
+        self.pending.append((cycle,kind,self.issued,UNIT_CODES[unit],reg,stall))
+        self.pending_instructions.append(instr)
+        if len(self.pending_instructions) >= self.chunk:
+            self.flush()
+    def flush(self):
+        'Copy staged records to the buffer'
+        instructions = self.pending_instructions
+        if not instructions:
+            return
+        fields = np.fromiter(itertools.chain.from_iterable(self.pending),dtype=np.int64,
+                             count=len(self.pending)*len(record_dtype.names)).reshape(len(self.pending),-1)
+        self.pending = []
+        self.pending_instructions = []
+        if not self.ring:
+            while self.count + len(instructions) > len(self.buffer):
+                self.buffer = np.resize(self.buffer,2*len(self.buffer))
+                self.instructions.extend([None]*len(self.instructions))
+        size = len(self.buffer)
+        if len(instructions) > size: # Ring smaller than a chunk
+            self.count += len(instructions) - size
+            fields, instructions = fields[-size:], instructions[-size:]
+        start = self.count % size
+        if start + len(instructions) <= size: # Contiguous, as always without ring
+            slots = slice(start,start + len(instructions))
+            self.instructions[slots] = instructions
+        else:
+            slots = (self.count + np.arange(len(instructions))) % size
+            for (slot,instr) in zip(slots.tolist(),instructions):
+                self.instructions[slot] = instr
+        for (name,column) in zip(record_dtype.names,fields.T):
+            self.buffer[name][slots] = column
+        self.count += len(instructions)
+    def issue(self,instr):
+        # Core.trace; append inlined, as this is called for every instruction
+        pending = self.pending
+        pending.append((self.core.cycle,ISSUE,self.issued,UNIT_CODES[instr.unit],-1,0))
+        self.pending_instructions.append(instr)
+        self.issued += 1
+        if len(pending) >= self.chunk:
+            self.flush()
+    def stall(self,d,stall,costs):
+        '''Core.trace_stall: record every reason decoded instruction d cannot
+        issue, given the costs Core.issue found for its unit, hazards, in-use
+        source and destination registers and WriteThrough tokens'''
+        c = self.core
+        (unit,hazards,inuse_src,inuse_dst,writethrough) = costs
+        # append inlined, as most instructions stall
+        (cycle,issued,code) = (c.cycle,self.issued,UNIT_CODES[d.unit])
+        pending = self.pending
+        start = len(pending)
+        if unit > 0:
+            pending.append((cycle,UNIT,issued,code,-1,unit))
+        if hazards or inuse_src or inuse_dst:
+            for (pipeline,kind,regs,total) in ((c.hazards,RAW,d.read,hazards),
+                                               (c.inuse_src,INUSE_SRC,d.read,inuse_src),
+                                               (c.inuse_dst,INUSE_DST,d.write,inuse_dst)):
+                if total > 0:
+                    for reg in regs:
+                        cost = pipeline.stall((reg,))
+                        if cost > 0:
+                            pending.append((cycle,kind,issued,code,reg,cost))
+        if writethrough > 0:
+            pending.append((cycle,WRITETHROUGH,issued,code,-1,writethrough))
+        if c.dispatch is not None and c.dispatch.stall(d.unit):
+            pending.append((cycle,DISPATCH,issued,code,-1,1))
+        self.pending_instructions.extend([d.instr]*(len(pending) - start))
+        if len(pending) >= self.chunk:
+            self.flush()
+    def order(self):
+        'Buffer slots from oldest to newest'
+        self.flush()
+        n = len(self.buffer)
+        start = self.count - len(self)
+        return [(start + i) % n for i in range(len(self))]
+    @property
+    def records(self):
+        self.flush()
+        if self.count <= len(self.buffer):
+            return self.buffer[:self.count]
+        return self.buffer[self.order()]
+    def save(self,path):
+        np.save(path,self.records)
+    def render(self):
+        return render(self.records,[self.instructions[slot] for slot in self.order()])
+
+def format_stall(reasons):
+    'The stall records of one instruction as Core.format_stall does'
+    text = []
+    for (kind,recs) in itertools.groupby(reasons,lambda rec:int(rec['kind'])):
+        recs = list(recs)
+        if kind == UNIT:
+            text.append('Instruction unit in use: %s (%d)' % (UNITS[recs[0]['unit']],recs[0]['stall']))
+        elif kind == WRITETHROUGH:
+            text.append('WriteThrough tokens in use')
+        elif kind == DISPATCH:
+            text.append('Dispatch group full')
+        else:
+            text.append('Register %s: %s' % (KINDS[kind],', '.join('(%s,%d)' % (FPRegister(int(rec['reg'])),rec['stall'])
+                                                                  for rec in recs)))
+    return '; '.join(text)
+
+def render(records,instructions=None):
+    '''Lines in the format of Core(use_trace=True), from records (loaded from
+    .npy if need be).  Without the instructions, issues show as #number.'''
+    reasons = []
+    for (i,rec) in enumerate(records):
+        if rec['kind'] != ISSUE:
+            reasons.append(rec)
+            continue
+        if reasons:
+            yield '[%2d] -- Stall %d: %s\n' % (reasons[0]['cycle'],max(rec['stall'] for rec in reasons),
+                                              format_stall(reasons))
+            reasons = []
+        instr = instructions[i] if instructions is not None else '#%d' % (rec['instr'],)
+        yield '[%2d] %s\n' % (rec['cycle'],instr)
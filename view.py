@@ -1,15 +1,23 @@
 class CViewer:
     def __init__(self,c):
         self.c = c
+        self.pointers = set()   # (number, C variable) of the int registers named_view used
+
+    def c_var(self, reg):
+        'C variable holding int register reg: its symbolic name, else its register name'
+        var = reg.c_var or reg.name
+        self.pointers.add((reg.num,var))
+        return var
 
     def view(self, i):
         return 'asm volatile("' + i.__class__.__name__  + ' ' + ', '.join(repr(r.num) for r in i.saved.values()) + '"); '
     def named_view(self, i):
+        saved = i.saved
         if i.__class__.__name__[0] == 'f':
             if self.c.no_fma==0:
                 inline_str = '    asm volatile("%s %s");' % (i.__class__.__name__,
-                                   ', '.join([('%d' % self.c.get_fpregister(k).num) for (temp, k) in i.saved.items()]))
-                fp_names = '// ' + ', '.join(['%d:%s' % (self.c.get_fpregister(k).num, k) for (temp, k) in i.saved.items()])
+                                   ', '.join([('%d' % self.c.get_fpregister(k).num) for (temp, k) in saved.items()]))
+                fp_names = '// ' + ', '.join(['%d:%s' % (self.c.get_fpregister(k).num, k) for (temp, k) in saved.items()])
     
                 return inline_str.ljust(70) + fp_names
             else:
@@ -18,10 +26,15 @@ class CViewer:
             if self.c.no_fma==0:
                 return '    asm volatile("nop");'
         else:
-            fp_reg = self.c.get_fpregister(list(i.saved.items())[0][1])
-            fp_names = '// ' + '%s:%s' % (fp_reg.num, list(i.saved.items())[0][1])
-            inline_str = '    asm volatile("%s %s, %%0, %%1":"+b" (%s):"b" (%s));' % (i.__class__.__name__,
-                           fp_reg.num,i.saved['ra'].c_var,i.saved['rb'].c_var)
+            fp_reg = self.c.get_fpregister(list(saved.items())[0][1])
+            fp_names = '// ' + '%s:%s' % (fp_reg.num, list(saved.items())[0][1])
+            ra = self.c.get_intregister(saved['ra'])
+            if 'd' in saved: # D-form, immediate displacement
+                inline_str = '    asm volatile("%s %s, %d(%%0)":"+b" (%s));' % (i.__class__.__name__,
+                               fp_reg.num,saved['d'],self.c_var(ra))
+            else:
+                inline_str = '    asm volatile("%s %s, %%0, %%1":"+b" (%s):"b" (%s));' % (i.__class__.__name__,
+                               fp_reg.num,self.c_var(ra),self.c_var(self.c.get_intregister(saved['rb'])))
             #if 'u' not in i.__class__.__name__: inline_str = inline_str.replace('+','=',1)
 
             return inline_str.ljust(70) + fp_names